@@ -50,49 +50,30 @@ import csv
 import re
 import time
 import pwlf
+import concurrent.futures
 
 import profile_from
+import prof_align
+import prof_funct
+from prof_funct import Profile
 
 # pylint: disable = C0103, C0121, W0102
 
-def cross_calibrate(reference, measured):
-    """ density mapping, reference -> measured
-
-    Calculated by overlaying intensity curves and observing values at
-    corresponding points. Note that the result is an unsmoothed, collection
-    of points.
+def _fit_curve(x, y):
+    """ monotonic curve through points, linear or piecewise-linear
 
     Parameters
     ----------
-    reference : string
-    measured : string
-        file names with path
+    x : np.array
+    y : np.array
+        sorted by x
 
     Returns
     -------
-    Profile
-
-    Notes
-    -----
-    Requires pwlf.  https://pypi.org/project/pwlf/
+    function
 
     """
 
-    reference = profile_from.snc_profiler(reference, 'rad')
-    measured = profile_from.narrow_png(measured)
-    measured = measured.align_to(reference)
-
-    dist_vals = np.arange(
-        max(min(measured.x), min(reference.x)),
-        min(max(measured.x), max(reference.x)),
-        max(reference.get_increment(), measured.get_increment()))
-
-    x = np.array([float(measured.get_y(i)) for i in dist_vals])
-    y = np.array([float(reference.get_y(i)) for i in dist_vals])
-
-    seq = np.argsort(x) 
-    x,y = x[seq], y[seq]
-
     def is_monotonic(func, x, y):
         return np.all(np.diff(func(x))>=0)
 
@@ -102,7 +83,7 @@ def cross_calibrate(reference, measured):
         def func(x):
             return np.multiply(m,x) + b
         return func
-    
+
     def piece_linear(x,y,num_pieces):
         my_pwlf = pwlf.PiecewiseLinFit(x, y)
         my_pwlf.fit(num_pieces)
@@ -111,10 +92,10 @@ def cross_calibrate(reference, measured):
         else:
             return None
 
-    start_time = time.clock()
+    start_time = time.time()
     last_func = linear(x,y)
     for num_pieces in range(2,10):
-        if (time.clock() - start_time) > 60:
+        if (time.time() - start_time) > 60:
             break
         next_func = piece_linear(x,y,num_pieces)
         if not next_func:
@@ -126,4 +107,168 @@ def cross_calibrate(reference, measured):
     # plt.plot(x,last_func(x))
     # plt.show()
 
-    return last_func
\ No newline at end of file
+    return last_func
+
+def cross_calibrate(reference, measured):
+    """ density mapping, reference -> measured
+
+    Calculated by overlaying intensity curves and observing values at
+    corresponding points. Note that the result is an unsmoothed, collection
+    of points.
+
+    Parameters
+    ----------
+    reference : string
+    measured : string
+        file names with path
+
+    Returns
+    -------
+    Profile
+
+    Notes
+    -----
+    Requires pwlf.  https://pypi.org/project/pwlf/
+
+    """
+
+    reference = profile_from.snc_profiler(reference, 'rad')
+    measured = profile_from.narrow_png(measured)
+    measured = measured.align_to(reference)
+
+    dist_vals = np.arange(
+        max(min(measured.x), min(reference.x)),
+        min(max(measured.x), max(reference.x)),
+        max(reference.get_increment(), measured.get_increment()))
+
+    x = np.array(measured.get_y(dist_vals), dtype=float)
+    y = np.array(reference.get_y(dist_vals), dtype=float)
+
+    seq = np.argsort(x)
+    x,y = x[seq], y[seq]
+
+    return _fit_curve(x, y)
+
+def cross_calibrate_rgb(reference, measured):
+    """ density mapping, reference -> measured, per colour channel
+
+    Red, green and blue channels are aligned together, using the
+    channel-averaged profile, and sampled at corresponding points in a
+    single pass. A curve is fitted to each channel and the resulting
+    doses are averaged.
+
+    Parameters
+    ----------
+    reference : string
+    measured : string
+        file names with path
+
+    Returns
+    -------
+    function
+        f(red, green, blue) -> dose
+
+    Notes
+    -----
+    Requires pwlf.  https://pypi.org/project/pwlf/
+
+    """
+
+    return cross_calibrate_batch(reference, [measured], rgb=True, workers=1)[0]
+
+def _aligned_samples(measured, reference, grid, rgb=False):
+    """ strip densities at grid distances, after alignment to reference
+
+    Parameters
+    ----------
+    measured : string
+        file name with path
+    reference : prof_align.Reference
+        prepared once for every strip
+    grid : np.array
+        distances at which to sample
+    rgb : bool, optional
+
+    Returns
+    -------
+    tuple
+        (offset, flipped, mask into grid, densities as points x channels)
+
+    """
+    if rgb:
+        channels = profile_from.narrow_png(measured, rgb=True)
+        stack = np.array([c.y for c in channels]).T
+    else:
+        channels = [profile_from.narrow_png(measured)]
+        stack = channels[0].y[:, np.newaxis]
+
+    grey = Profile(x=channels[0].x, y=np.average(stack, axis=1))
+    aligned, offset, flipped = reference.align(grey)
+    if flipped:
+        stack = stack[::-1]
+
+    mask = np.logical_and(grid >= max(min(aligned.x), min(reference.profile.x)),
+                          grid < min(max(aligned.x), max(reference.profile.x)))
+    densities = interpolate.interp1d(aligned.x, stack, axis=0,
+                                     bounds_error=False,
+                                     fill_value=0.0)(grid[mask])
+    return offset, flipped, mask, densities
+
+def cross_calibrate_batch(reference, measured, rgb=False, workers=None):
+    """ density mapping, reference -> many measured strips
+
+    The reference is read, sampled and prepared for alignment once, as
+    by prof_align.align_many. Strips are aligned to it in parallel and
+    the sample pairs from all strips are pooled into a single fit.
+
+    Parameters
+    ----------
+    reference : string
+    measured : list of string
+        file names with path
+    rgb : bool, optional
+        fit each colour channel, as for cross_calibrate_rgb
+    workers : int, optional
+        number of worker processes, defaults to the number of processors
+
+    Returns
+    -------
+    tuple
+        (function, [(offset, flipped), ...] per strip)
+
+    Notes
+    -----
+    Requires pwlf.  https://pypi.org/project/pwlf/
+
+    """
+
+    reference = profile_from.snc_profiler(reference, 'rad')
+    grid = np.arange(min(reference.x), max(reference.x),
+                     reference.get_increment())
+    grid_dose = np.array(reference.get_y(grid), dtype=float)
+
+    prepared = prof_align.Reference(reference)
+    align = partial(_aligned_samples, reference=prepared, grid=grid, rgb=rgb)
+    if workers == 1 or len(measured) == 1:
+        samples = list(map(align, measured))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=prof_funct.set_precision,
+                initargs=(prof_funct._precision,)) as pool:
+            samples = list(pool.map(align, measured))
+
+    offsets = [(offset, flipped) for offset, flipped, _, _ in samples]
+    x = np.concatenate([densities for _, _, _, densities in samples])
+    y = np.concatenate([grid_dose[mask] for _, _, mask, _ in samples])
+
+    seq = np.argsort(x, axis=0)
+    x, y = np.take_along_axis(x, seq, axis=0), y[seq]
+
+    funcs = [_fit_curve(x[:, c], y[:, c]) for c in range(x.shape[1])]
+    if not rgb:
+        return funcs[0], offsets
+
+    def func(red, green, blue):
+        return np.average([f(v) for f, v in zip(funcs, (red, green, blue))],
+                          axis=0)
+    return func, offsets
@@ -0,0 +1,166 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Align many profiles to one reference, as Profile.align_to.
+
+    Examples
+    --------
+    ``strips = [profile_from.narrow_png(f) for f in file_names]``
+    ``aligned, offsets, flipped = prof_align.align_many(reference, strips)``
+"""
+
+import concurrent.futures
+
+import numpy as np
+from scipy import fft
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _sampled(profile, step):
+    """ (first x, y) at equal steps from the smallest x """
+    x = np.asarray(profile.x, dtype=float)
+    begin = x.min()
+    num_points = int(np.floor((x.max() - begin) / step + 1e-9)) + 1
+    return begin, np.asarray(profile.interp(begin + step * np.arange(num_points)), dtype=float)
+
+
+def parabola(below, peak, above):
+    """ offset of the vertex from the middle of three equally spaced values
+
+    Fraction of a step, between -0.5 and 0.5 for a peak, else 0. Used to
+    refine correlation peaks between samples, here and in prof_plane.
+
+    """
+    denom = below - 2*peak + above
+    return 0.5 * (below - above) / denom if denom < 0 else 0.0
+
+
+def _peak(c):
+    """ index of the greatest value, refined by a parabola through its neighbours """
+    i = int(np.argmax(c))
+    if 0 < i < len(c) - 1:
+        return i + parabola(c[i-1], c[i], c[i+1])
+    return float(i)
+
+
+class Reference():
+    """ a reference profile prepared once for aligning many others
+
+    Attributes
+    ----------
+    profile : Profile
+    step : float
+        sampling increment of the correlation
+    begin : float
+        first x of the resampled reference
+    y : np.array
+        reference resampled at step
+
+    """
+
+    def __init__(self, profile, step=None):
+        self.profile = profile
+        self.step = step or profile.get_increment()
+        self.begin, self.y = _sampled(profile, self.step)
+        self._spectra = {}
+
+    def spectrum(self, length):
+        """ real FFT of the resampled reference, zero-padded to length, cached """
+        if length not in self._spectra:
+            self._spectra[length] = fft.rfft(self.y, length)
+        return self._spectra[length]
+
+    def align(self, profile):
+        """ profile aligned to the reference
+
+        The cross-correlation at every shift comes from one FFT of the
+        resampled profile. Multiplying by the conjugate of its spectrum
+        correlates the profile, multiplying by the spectrum itself
+        correlates its mirror image, which is the flip test of align_to.
+        The best shift is refined between samples by a parabola.
+
+        Returns
+        -------
+        tuple
+            (aligned Profile, offset, flipped)
+
+        """
+        begin, y = _sampled(profile, self.step)
+        n, m = len(self.y), len(y)
+        length = fft.next_fast_len(n + m - 1, real=True)
+        ref = self.spectrum(length)
+        spec = fft.rfft(y, length)
+        corr = fft.irfft(ref * np.conj(spec), length)
+        conv = fft.irfft(ref * spec, length)
+
+        # corr[L] PAIRS y[k] WITH REFERENCE y[k+L], conv[L+m-1] THE SAME FOR y REVERSED
+        lags = np.arange(-(m - 1), n)
+        corr = corr[lags % length]
+        conv = conv[lags + m - 1]
+        flipped = conv.max() > corr.max()
+        lag = _peak(conv if flipped else corr) - (m - 1)
+        offset = self.begin - begin + lag * self.step
+        if flipped:
+            # make_flipped MIRRORS ABOUT THE CENTRE OF x, NOT OF THE SAMPLES
+            x = np.asarray(profile.x, dtype=float)
+            offset -= (x.min() + x.max()) - (2*begin + (m - 1) * self.step)
+            return profile.make_flipped() + offset, offset, True
+        return profile + offset, offset, False
+
+
+def align_many(reference, profiles, step=None, workers=None):
+    """ profiles aligned to reference, each as by align_to
+
+    The reference is resampled and transformed once. Profiles are
+    aligned in a thread pool sharing it, the FFTs releasing the GIL.
+    Offsets are found between samples, so may differ from align_to by
+    less than one step.
+
+    Parameters
+    ----------
+    reference : Profile
+    profiles : list of Profile
+    step : float, optional
+        sampling increment, defaults to that of reference
+    workers : int, optional
+        number of threads, 1 aligns in turn
+
+    Returns
+    -------
+    tuple
+        (list of aligned Profile, np.array of offsets, np.array of flipped)
+
+    """
+    prepared = Reference(reference, step)
+    if workers == 1:
+        results = [prepared.align(p) for p in profiles]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(prepared.align, profiles))
+    aligned = [r[0] for r in results]
+    offsets = np.array([r[1] for r in results], dtype=float)
+    flipped = np.array([r[2] for r in results], dtype=bool)
+    return aligned, offsets, flipped
@@ -0,0 +1,257 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Headless batch analysis of profile files.
+
+    Usage
+    -----
+    ``python prof_batch.py data/ --analyses edges flatness --format csv``
+    ``python prof_batch.py "scans/*.asc" --reference tps.dat --out qa.jsonl``
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import argparse
+import concurrent.futures
+
+from functools import partial
+
+import numpy as np
+
+import profile_from
+import prof_funct
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _edges(profile, reference=None):
+    lt_edge, rt_edge = profile.get_edges()
+    return {'edge_left': float(lt_edge), 'edge_right': float(rt_edge)}
+
+
+def _flatness(profile, reference=None):
+    return {'flatness': float(profile.get_flatness())}
+
+
+def _symmetry(profile, reference=None):
+    return {'symmetry': float(profile.get_symmetry())}
+
+
+def _penumbra_width(half, edge):
+    """ distance between the 20% and 80% crossings nearest edge, as slice_penumbra """
+    lo, hi = min(half.y), max(half.y)
+    crossings = [min(half.get_x(level), key=lambda x: abs(x - edge))
+                 for level in (lo + 0.2*(hi - lo), hi - 0.2*(hi - lo))]
+    return abs(crossings[1] - crossings[0])
+
+
+def _penumbra(profile, reference=None):
+    lt_edge, rt_edge = profile.get_edges()
+    centre = 0.5 * (lt_edge + rt_edge)
+    return {'penumbra_left': float(_penumbra_width(profile.slice_segment(stop=centre), lt_edge)),
+            'penumbra_right': float(_penumbra_width(profile.slice_segment(start=centre), rt_edge))}
+
+
+def _gamma(profile, reference=None):
+    if reference is None:
+        return {'gamma_pass': None}
+    gamma = profile.get_gamma(reference)
+    return {'gamma_pass': float(np.mean(gamma.y <= 1.0))}
+
+
+# NAME: (FUNCTION, RESULT FIELDS)
+ANALYSES = {
+    'edges': (_edges, ('edge_left', 'edge_right')),
+    'flatness': (_flatness, ('flatness',)),
+    'symmetry': (_symmetry, ('symmetry',)),
+    'penumbra': (_penumbra, ('penumbra_left', 'penumbra_right')),
+    'gamma': (_gamma, ('gamma_pass',)),
+}
+
+DEFAULT_ANALYSES = ['edges', 'flatness', 'symmetry', 'penumbra']
+
+
+def fields(analyses):
+    """ result row keys, in order, for the named analyses """
+    keys = ['file', 'index', 'points']
+    for name in analyses:
+        keys += list(ANALYSES[name][1])
+    return keys + ['error']
+
+
+def analyse(profile, analyses, reference=None):
+    """ run named analyses on one profile
+
+    A failing analysis leaves its fields empty and is reported in
+    'error', without stopping the others.
+
+    Parameters
+    ----------
+    profile : Profile
+    analyses : list of str
+        keys of ANALYSES
+    reference : Profile, optional
+        for gamma
+
+    Returns
+    -------
+    dict
+
+    """
+    row = {'points': len(profile)}
+    errors = []
+    for name in analyses:
+        func, keys = ANALYSES[name]
+        try:
+            row.update(func(profile, reference))
+        except Exception as error:  # pylint: disable = W0703
+            row.update(dict.fromkeys(keys))
+            errors.append('{}: {}'.format(name, error))
+    row['error'] = '; '.join(errors) or None
+    return row
+
+
+def analyse_file(file_name, analyses, reference=None):
+    """ run named analyses on every profile in a file
+
+    Parameters
+    ----------
+    file_name : str
+    analyses : list of str
+    reference : Profile, optional
+
+    Returns
+    -------
+    list of dict
+        one row per profile, or a single error row if the file
+        cannot be read
+
+    """
+    try:
+        profiles = profile_from.from_file(file_name)
+    except Exception as error:  # pylint: disable = W0703
+        row = dict.fromkeys(fields(analyses))
+        row.update({'file': file_name, 'error': 'import: {}'.format(error)})
+        return [row]
+    rows = []
+    for index, profile in enumerate(profiles):
+        row = {'file': file_name, 'index': index}
+        row.update(analyse(profile, analyses, reference))
+        rows.append(row)
+    return rows
+
+
+def expand(paths):
+    """ file names from files, directories and glob patterns
+
+    Directories are searched recursively for recognised extensions.
+
+    """
+    extensions = ('.prs', '.png', '.csv', '.asc', '.dat')
+    file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                file_names += [os.path.join(root, n) for n in sorted(names)
+                               if os.path.splitext(n)[1].lower() in extensions]
+        elif os.path.isfile(path):
+            file_names.append(path)
+        else:
+            file_names += sorted(glob.glob(path, recursive=True))
+    return file_names
+
+
+def run(file_names, analyses, reference=None, workers=None):
+    """ rows for each file, yielded as each file finishes
+
+    Parameters
+    ----------
+    file_names : list of str
+    analyses : list of str
+    reference : Profile, optional
+    workers : int, optional
+        number of worker processes, defaults to the number of processors
+
+    Yields
+    ------
+    dict
+
+    """
+    func = partial(analyse_file, analyses=analyses, reference=reference)
+    if workers == 1:
+        for file_name in file_names:
+            yield from func(file_name)
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=prof_funct.set_precision,
+            initargs=(prof_funct._precision,)) as pool:
+        futures = [pool.submit(func, file_name) for file_name in file_names]
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+',
+                        help='files, directories or glob patterns')
+    parser.add_argument('--analyses', nargs='+', choices=list(ANALYSES),
+                        default=DEFAULT_ANALYSES)
+    parser.add_argument('--reference', help='reference file, for gamma')
+    parser.add_argument('--reference-index', type=int, default=0,
+                        help='which profile in the reference file')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='jsonl')
+    parser.add_argument('--out', help='output file, default stdout')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    analyses = list(args.analyses)
+    reference = None
+    if args.reference:
+        reference = profile_from.from_file(args.reference)[args.reference_index]
+        if 'gamma' not in analyses:
+            analyses.append('gamma')
+
+    out_file = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out_file, fieldnames=fields(analyses))
+            writer.writeheader()
+        for row in run(expand(args.paths), analyses, reference, args.workers):
+            if args.format == 'csv':
+                writer.writerow(row)
+            else:
+                out_file.write(json.dumps(row) + '\n')
+            out_file.flush()
+    finally:
+        if args.out:
+            out_file.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Timing benchmarks for Profile methods and profile_from importers.
+
+    Usage
+    -----
+    ``python prof_bench.py --out new.json``
+    ``python prof_bench.py --out new.json --compare old.json``
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import timeit
+import platform
+import argparse
+
+import numpy as np
+
+import prof_funct
+import prof_kernels
+from prof_funct import Profile
+import profile_from
+
+# pylint: disable = C0103, C0121, W0102
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+SIZES = (83, 1000, 10000, 100000, 1000000)
+
+# (method, args, largest size benchmarked), 'method:option' PASSES option=True
+# CAPS ARE WHERE THE CURRENT ALGORITHM BECOMES IMPRACTICAL, RAISE AS FIXED
+METHODS = [
+    ('__init__', None, None),
+    ('__add__', (1.0,), None),
+    ('__sub__', (1.0,), None),
+    ('__mul__', (1.0,), None),
+    ('__truediv__', (2.0,), None),
+    ('get_y', (np.linspace(-12, 12, 1000),), None),
+    ('get_x', (0.5,), 100000),
+    ('get_increment', (), None),
+    ('slice_segment', (-5, 5), None),
+    ('resample_x', (0.01,), None),
+    ('resample_y', (0.01,), 100000),
+    ('make_normal_y', (), None),
+    ('get_edges', (), None),
+    ('make_normal_x', (), None),
+    ('slice_umbra', (), None),
+    ('slice_penumbra', (), 10000),
+    ('slice_shoulders', (), 10000),
+    ('slice_tails', (), 10000),
+    ('get_flatness', (), None),
+    ('get_symmetry', (), None),
+    ('get_gamma', None, 10000),
+    ('make_symmetric', (), None),
+    ('make_centered', (), None),
+    ('make_interp', (), None),
+    ('make_flipped', (), None),
+    ('get_pyramid', (), None),
+    ('align_to', None, 1000),
+    ('align_to:coarse_to_fine', None, 100000),
+]
+
+# profile_from.beam ARGUMENTS OF THE SYNTHETIC PROFILES, FLAT 2% TAILS
+SYNTHETIC = {'field_size': 10.0, 'penumbra': 0.36, 'tail_length': np.inf}
+
+# (importer, file pattern under data/, extra args)
+IMPORTERS = [
+    ('snc_profiler', '**/*.prs', ('rad',)),
+    ('narrow_png', '**/*.png', ()),
+    ('raystation_line', '*.csv', ()),
+    ('rfa_ascii', '*.asc', ()),
+    ('pinnacle_ascii', '*.dat', ()),
+]
+
+
+def _time(func, repeat=3):
+    """ best seconds per call, over repeated runs """
+    start = time.perf_counter()
+    func()
+    once = time.perf_counter() - start
+    if once > 1.0:
+        return once
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _method_call(profile, method, args):
+    """ zero-argument callable timing one method on a fresh copy """
+    if method == '__init__':
+        x, y = profile.x, profile.y
+        return lambda: Profile(x=x, y=y)
+    method, _, option = method.partition(':')
+    kwargs = {option: True} if option else {}
+    if method == 'align_to':
+        other = profile + 1.0
+        return lambda: profile.align_to(other, **kwargs)
+    if method == 'get_gamma':
+        reference = profile + 0.05
+        return lambda: profile.get_gamma(reference)
+    if method == 'get_pyramid':
+        def rebuild():
+            profile._pyramid = None  # pylint: disable = W0212
+            return profile.get_pyramid()
+        return rebuild
+    bound = getattr(profile, method)
+    return lambda: bound(*args, **kwargs)
+
+
+def bench_methods(sizes=SIZES, data_files=True, repeat=3):
+    """ time every Profile method
+
+    Parameters
+    ----------
+    sizes : tuple of int, optional
+        synthetic profile sizes
+    data_files : bool, optional
+        also time on the first profile from each bundled data file
+    repeat : int, optional
+        timing runs, of which the best is kept
+
+    Returns
+    -------
+    list of dict
+
+    """
+    sources = [('synthetic', profile_from.beam(num_points=n, **SYNTHETIC)) for n in sizes]
+    if data_files:
+        sources += [(name, profile) for name, profile in _data_profiles()]
+
+    results = []
+    for source, profile in sources:
+        for method, args, cap in METHODS:
+            if cap and len(profile) > cap:
+                continue
+            try:
+                seconds = _time(_method_call(profile, method, args), repeat)
+            except Exception as error:  # pylint: disable = W0703
+                seconds = None
+                print('{} on {}: {}'.format(method, source, error), file=sys.stderr)
+            results.append({'name': 'Profile.' + method, 'source': source,
+                            'points': len(profile), 'seconds': seconds})
+    return results
+
+
+def _data_files():
+    """ (importer, file name, args) for each bundled data file """
+    for importer, pattern, args in IMPORTERS:
+        for file_name in sorted(glob.glob(os.path.join(DATA_DIR, pattern),
+                                          recursive=True)):
+            yield importer, file_name, args
+
+
+def _data_profiles():
+    """ (file name, first Profile) for each bundled data file """
+    for importer, file_name, args in _data_files():
+        try:
+            result = getattr(profile_from, importer)(file_name, *args)
+        except Exception:  # pylint: disable = W0703
+            continue
+        if isinstance(result, list):
+            result = result[0]
+        yield os.path.relpath(file_name, DATA_DIR), result
+
+
+def bench_importers(sizes=SIZES, repeat=3):
+    """ time every profile_from importer
+
+    File importers run over the bundled data files; lists, tuples,
+    pulse and beam run over the synthetic sizes.
+
+    Parameters
+    ----------
+    sizes : tuple of int, optional
+    repeat : int, optional
+
+    Returns
+    -------
+    list of dict
+
+    """
+    results = []
+    for n in sizes:
+        profile = profile_from.beam(num_points=n, **SYNTHETIC)
+        x, y = list(profile.x), list(profile.y)
+        pairs = list(zip(x, y))
+        increment = 30.0 / (n - 1)
+        for name, func in (
+                ('lists', lambda: profile_from.lists(x, y)),
+                ('tuples', lambda: profile_from.tuples(pairs)),
+                ('pulse', lambda: profile_from.pulse(0.0, 10.0, (-15, 15), increment)),
+                ('beam', lambda: profile_from.beam(num_points=n, noise=0.01))):
+            results.append({'name': 'profile_from.' + name, 'source': 'synthetic',
+                            'points': n, 'seconds': _time(func, repeat)})
+
+    for importer, file_name, args in _data_files():
+        func = getattr(profile_from, importer)
+        try:
+            seconds = _time(lambda: func(file_name, *args), repeat)
+            result = func(file_name, *args)
+            points = sum(len(p) for p in result) if isinstance(result, list) \
+                else len(result)
+        except Exception as error:  # pylint: disable = W0703
+            seconds, points = None, None
+            print('{} on {}: {}'.format(importer, file_name, error), file=sys.stderr)
+        results.append({'name': 'profile_from.' + importer,
+                        'source': os.path.relpath(file_name, DATA_DIR),
+                        'points': points, 'seconds': seconds})
+    return results
+
+
+def bench_precision(sizes=SIZES, repeat=3,
+                    methods=('get_y', 'resample_x', 'slice_segment', 'get_flatness')):
+    """ memory and time of float64 against float32 storage
+
+    Parameters
+    ----------
+    sizes : tuple of int, optional
+    repeat : int, optional
+    methods : tuple of str, optional
+        Profile methods timed, with the METHODS arguments
+
+    Returns
+    -------
+    list of dict
+        as bench_methods, named e.g. 'float32.Profile.get_y', with the
+        bytes held in x and y of the profile
+
+    """
+    args = {method: a for method, a, _ in METHODS}
+    results = []
+    for dtype in ('float64', 'float32'):
+        with prof_funct.precision(dtype):
+            for n in sizes:
+                profile = profile_from.beam(num_points=n, **SYNTHETIC)
+                num_bytes = profile.x.nbytes + profile.y.nbytes
+                for method in methods:
+                    seconds = _time(_method_call(profile, method, args[method]), repeat)
+                    results.append({'name': '{}.Profile.{}'.format(dtype, method),
+                                    'source': 'synthetic', 'points': n,
+                                    'seconds': seconds, 'bytes': num_bytes})
+    return results
+
+
+def run(sizes=SIZES, data_files=True, repeat=3):
+    """ full benchmark, as a JSON-serialisable dict
+
+    Parameters
+    ----------
+    sizes : tuple of int, optional
+    data_files : bool, optional
+    repeat : int, optional
+
+    Returns
+    -------
+    dict
+        {'meta': {...}, 'results': [{'name', 'source', 'points', 'seconds'}, ...]}
+
+    """
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'kernels': prof_kernels.BACKEND,
+            'platform': platform.platform(),
+            'sizes': list(sizes)}
+    results = (bench_importers(sizes, repeat) +
+               bench_methods(sizes, data_files, repeat) +
+               bench_precision(sizes, repeat))
+    return {'meta': meta, 'results': results}
+
+
+def compare(new, old, threshold=1.2):
+    """ ratios of new to old timings
+
+    Parameters
+    ----------
+    new : dict
+    old : dict
+        as returned by run()
+    threshold : float, optional
+        ratio above which a result counts as slower
+
+    Returns
+    -------
+    list of tuple
+        (name, source, points, old seconds, new seconds, ratio, slower)
+
+    """
+    def key(result):
+        return (result['name'], result['source'], result['points'])
+    previous = {key(r): r['seconds'] for r in old['results']}
+    rows = []
+    for result in new['results']:
+        before = previous.get(key(result))
+        after = result['seconds']
+        if before and after:
+            ratio = after / before
+            rows.append(key(result) + (before, after, ratio, ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--no-data', action='store_true',
+                        help='skip profiles from the bundled data files')
+    parser.add_argument('--out', help='write results as JSON')
+    parser.add_argument('--compare', help='earlier JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run(tuple(args.sizes), not args.no_data, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump(results, out_file, indent=1)
+
+    fmt = '{:<30} {:<45} {:>8} {:>12}'
+    print(fmt.format('name', 'source', 'points', 'seconds'))
+    for r in results['results']:
+        seconds = '-' if r['seconds'] is None else '{:.3g}'.format(r['seconds'])
+        print(fmt.format(r['name'], r['source'], str(r['points']), seconds))
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as old_file:
+        old = json.load(old_file)
+    rows = compare(results, old, args.threshold)
+    fmt = '{:<30} {:<45} {:>8} {:>10} {:>10} {:>7} {}'
+    print()
+    print(fmt.format('name', 'source', 'points', 'old', 'new', 'ratio', ''))
+    for name, source, points, before, after, ratio, slower in rows:
+        print(fmt.format(name, source, str(points), '{:.3g}'.format(before),
+                         '{:.3g}'.format(after), '{:.2f}'.format(ratio),
+                         'SLOWER' if slower else ''))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" SQLite catalog of profile metadata, with lazily loaded profiles.
+
+    Examples
+    --------
+    ``catalog = prof_catalog.Catalog('profiles.db')``
+    ``catalog.add_folder('/shared/scans')``
+    ``for handle in catalog.query(energy=6, field_size=10, depth=10,``
+    ``                            direction='crossline'):``
+    ``    profile = handle.load()``
+"""
+
+import os
+import re
+import json
+import sqlite3
+
+import profile_from
+import prof_batch
+
+# pylint: disable = C0103, C0121, W0102
+
+# NORMALISED KEYS, CM AND MV
+KEYS = ('source', 'energy', 'field_x', 'field_y', 'ssd', 'wedge',
+        'depth', 'direction', 'offset')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    file TEXT, idx INTEGER, mtime_ns INTEGER, size INTEGER,
+    source TEXT, energy REAL, field_x REAL, field_y REAL, ssd REAL,
+    wedge TEXT, depth REAL, direction TEXT, offset REAL,
+    points INTEGER, x_min REAL, x_max REAL, meta TEXT,
+    PRIMARY KEY (file, idx));
+CREATE INDEX IF NOT EXISTS profiles_beam
+    ON profiles (energy, field_x, field_y, direction, depth);
+"""
+
+
+def _number(text):
+    """ leading number in text, e.g. '100cm' -> 100.0, or None """
+    match = re.search(r'-?\d+\.?\d*', str(text))
+    return float(match.group()) if match else None
+
+
+def _cm(mm):
+    """ mm as cm, None if missing """
+    return None if mm is None else mm / 10
+
+
+def _no_wedge(wedge):
+    """ '' for open fields, else the wedge as given """
+    wedge = str(wedge).strip()
+    if wedge.lower().startswith('none') or _number(wedge) == 0 and \
+       wedge.replace('.', '').isdigit():
+        return ''
+    return wedge
+
+
+def normalise(meta, file_name, index=0):
+    """ common metadata keys from importer-specific meta
+
+    Parameters
+    ----------
+    meta : dict
+        Profile.meta as set by a profile_from importer
+    file_name : str
+        for the importer, by extension
+    index : int, optional
+        position in the file, which for a Profiler file is the axis
+
+    Returns
+    -------
+    dict
+        KEYS, distances in cm, energy in MV, missing values None
+
+    """
+    result = dict.fromkeys(KEYS)
+    extension = os.path.splitext(file_name)[1].lower()
+
+    if extension == '.asc':  # RFA, MM
+        result['source'] = 'rfa'
+        if 'beam' in meta:
+            result['energy'] = _number(meta['beam'][1])
+        result['field_x'], result['field_y'] = \
+            [_cm(_number(f)) for f in meta['field_size']]
+        result['ssd'] = _cm(_number(meta['SSD']))
+        result['wedge'] = _no_wedge(meta['wedge'])
+        start = [_number(v) for v in meta['start_pt']]
+        end = [_number(v) for v in meta['end_pt']]
+        moving = [i for i in range(3) if start[i] != end[i]]
+        if None in start + end:
+            moving = None  # DIRECTION UNKNOWN
+        elif moving == [0]:
+            result['direction'] = 'crossline'
+            result['offset'] = _cm(start[1])
+        elif moving == [1]:
+            result['direction'] = 'inline'
+            result['offset'] = _cm(start[0])
+        elif moving == [2]:
+            result['direction'] = 'depth'
+        if moving is not None and 2 not in moving:
+            result['depth'] = _cm(start[2])
+
+    elif extension == '.dat':  # PINNACLE, CM
+        result['source'] = 'pinnacle'
+        result['energy'] = _number(meta['energy'])
+        jaws = [_number(j) for j in meta['jaws']]
+        if None not in jaws:
+            result['field_x'], result['field_y'] = jaws[0] + jaws[1], jaws[2] + jaws[3]
+        result['ssd'] = _number(meta['ssd'])
+        result['wedge'] = _no_wedge(meta['wedge'])
+        result['direction'] = {'X': 'crossline', 'Y': 'inline', 'D': 'depth'}.get(
+            meta['type'][0])
+        if result['direction'] != 'depth':
+            result['depth'] = _number(meta['depth'])
+            result['offset'] = _number(meta['offset'])
+
+    elif extension == '.prs':  # PROFILER, AXIS BY POSITION IN from_file
+        result['source'] = 'profiler'
+        result['energy'] = _number(meta.get('Energy'))
+        collimator = dict(re.findall(r'(\w+):(-?\d+\.?\d*)', meta.get('Collimator', '')))
+        if any(float(v) for v in collimator.values()) and \
+           set(collimator) >= {'Left', 'Right', 'Top', 'Bottom'}:  # ZEROS IF NOT ENTERED
+            result['field_x'] = float(collimator['Left']) + float(collimator['Right'])
+            result['field_y'] = float(collimator['Top']) + float(collimator['Bottom'])
+        result['ssd'] = _number(meta.get('SSD'))
+        result['wedge'] = _no_wedge(meta.get('Wedge', ''))
+        result['depth'] = _number(meta.get('Buildup'))
+        result['direction'] = ('crossline', 'inline')[index]
+        result['offset'] = 0.0
+
+    elif extension == '.csv':
+        result['source'] = 'raystation'
+    elif extension == '.png':
+        result['source'] = 'film'
+    return result
+
+
+class ProfileHandle():
+    """ catalog entry, loading its Profile only when asked
+
+    Attributes
+    ----------
+    file : str
+    index : int
+    meta : dict
+        normalised metadata, plus points, x_min and x_max
+
+    """
+
+    def __init__(self, catalog, file, index, meta):
+        self.catalog = catalog
+        self.file = file
+        self.index = index
+        self.meta = meta
+
+    def __repr__(self):
+        return 'ProfileHandle({!r}, {})'.format(self.file, self.index)
+
+    def load(self):
+        """ the Profile, from its file """
+        return self.catalog.load(self.file)[self.index]
+
+
+class ImportFailed(Exception):
+    """ file could not be read by its importer """
+
+
+class Catalog():
+    """ SQLite-backed metadata index of profile files
+
+    Attributes
+    ----------
+    db : sqlite3.Connection
+    skipped : dict
+        {file: error} of files add_folder could not import
+
+    """
+
+    def __init__(self, db_file=':memory:'):
+        self.db = sqlite3.connect(db_file)
+        self.db.executescript(_SCHEMA)
+        self.skipped = {}
+        self._loaded = {}  # (file, mtime_ns): [Profile], LAST FILE ONLY
+
+    def add_file(self, file_name):
+        """ index every profile in a file, unless already indexed unchanged
+
+        Returns
+        -------
+        int
+            number of profiles indexed, 0 if unchanged
+
+        Raises
+        ------
+        ImportFailed
+            if the importer for the file fails
+
+        """
+        file_name = os.path.abspath(file_name)
+        stat = os.stat(file_name)
+        row = self.db.execute('SELECT mtime_ns, size FROM profiles WHERE file = ?',
+                              (file_name,)).fetchone()
+        if row == (stat.st_mtime_ns, stat.st_size):
+            return 0
+        try:
+            profiles = profile_from.from_file(file_name)
+        except Exception as error:  # pylint: disable = W0703
+            raise ImportFailed('{}: {}'.format(type(error).__name__, error)) from error
+        with self.db:
+            self.db.execute('DELETE FROM profiles WHERE file = ?', (file_name,))
+            for index, profile in enumerate(profiles):
+                meta = normalise(profile.meta, file_name, index)
+                self.db.execute(
+                    'INSERT INTO profiles VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                    (file_name, index, stat.st_mtime_ns, stat.st_size) +
+                    tuple(meta[k] for k in KEYS) +
+                    (len(profile), float(min(profile.x)), float(max(profile.x)),
+                     json.dumps(profile.meta)))
+        self._loaded = {(file_name, stat.st_mtime_ns): profiles}
+        return len(profiles)
+
+    def add_folder(self, folder):
+        """ index every recognised file under folder
+
+        Files that cannot be imported are recorded in skipped, with the
+        error, and left out. Errors in normalising metadata are raised.
+
+        Returns
+        -------
+        int
+            number of profiles indexed
+
+        """
+        count = 0
+        for file_name in prof_batch.expand([folder]):
+            try:
+                count += self.add_file(file_name)
+            except ImportFailed as error:
+                self.skipped[os.path.abspath(file_name)] = str(error)
+            else:
+                self.skipped.pop(os.path.abspath(file_name), None)
+        return count
+
+    def query(self, field_size=None, tol=0.05, **criteria):
+        """ handles for profiles matching all criteria
+
+        Parameters
+        ----------
+        field_size : float or tuple, optional
+            square side, or (x, y)
+        tol : float, optional
+            tolerance for numeric criteria
+        **criteria
+            any of KEYS, and file
+
+        Returns
+        -------
+        list of ProfileHandle
+
+        """
+        if field_size is not None:
+            if not isinstance(field_size, (tuple, list)):
+                field_size = (field_size, field_size)
+            criteria['field_x'], criteria['field_y'] = field_size
+        clauses, values = [], []
+        for key, value in criteria.items():
+            if key not in KEYS + ('file',):
+                raise KeyError(key)
+            if isinstance(value, (int, float)):
+                clauses.append('{} BETWEEN ? AND ?'.format(key))
+                values += [value - tol, value + tol]
+            else:
+                clauses.append('{} = ?'.format(key))
+                values.append(value)
+        sql = 'SELECT file, idx, points, x_min, x_max, {} FROM profiles'.format(
+            ', '.join(KEYS))
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY file, idx'
+        handles = []
+        for row in self.db.execute(sql, values):
+            meta = dict(zip(('points', 'x_min', 'x_max') + KEYS, row[2:]))
+            handles.append(ProfileHandle(self, row[0], row[1], meta))
+        return handles
+
+    def load(self, file_name):
+        """ all profiles in a file, keeping the last file loaded """
+        key = (file_name, os.stat(file_name).st_mtime_ns)
+        if key not in self._loaded:
+            self._loaded = {key: profile_from.from_file(file_name)}
+        return self._loaded[key]
+
+    def close(self):
+        self.db.close()
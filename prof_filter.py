@@ -0,0 +1,154 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Smoothing filters for noisy film and detector profiles.
+
+    Widths are distances in cm, so the same filter suits any sampling.
+    Profiles sharing the same x are filtered together as one array.
+
+    Examples
+    --------
+    ``smooth = prof_filter.savgol(profile_from.narrow_png(file_name), 0.5)``
+    ``smooth_list = prof_filter.median(strips, window=0.3)``
+"""
+
+import numpy as np
+from scipy import signal, ndimage
+
+from prof_funct import Profile
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _samples(width, step):
+    """ odd number of samples spanning width """
+    return 2 * int(round(0.5 * width / step)) + 1
+
+
+def _uniform(profile):
+    """ (x, step) of profile's own grid, or of an equal-step grid over it """
+    x = np.asarray(profile.x, dtype=float)
+    if profile.grid:
+        return x, profile.grid[1]
+    span = x.max() - x.min()
+    num_points = int(round(span / np.median(np.diff(np.sort(x))))) + 1
+    return np.linspace(x.min(), x.max(), num_points), span / (num_points - 1)  # ENDS KEPT INSIDE x
+
+
+def _apply(profiles, func):
+    """ func(y array of shape (profiles, points), step) over profiles
+
+    Returns
+    -------
+    Profile or list of Profile
+        as given
+
+    """
+    single = isinstance(profiles, Profile)
+    if single:
+        profiles = [profiles]
+    groups = {}  # SAME SAMPLE POINTS FILTERED TOGETHER
+    for i, profile in enumerate(profiles):
+        key = np.asarray(profile.x, dtype=float).tobytes()
+        groups.setdefault(key, []).append(i)
+
+    result = [None] * len(profiles)
+    for indices in groups.values():
+        first = profiles[indices[0]]
+        x, step = _uniform(first)
+        if first.grid:
+            y = np.array([profiles[i].y for i in indices], dtype=float)
+        else:
+            y = np.array([profiles[i].get_y(x) for i in indices], dtype=float)
+        y = func(y, step)
+        for row, i in enumerate(indices):
+            p = profiles[i]
+            new_y = y[row] if p.grid else np.interp(p.x, x, y[row])
+            result[i] = Profile(p.x, new_y, meta=p.meta, kind=p.kind)
+    return result[0] if single else result
+
+
+def savgol(profiles, window=0.5, order=2):
+    """ Savitzky-Golay smoothing
+
+    Fits a polynomial over a moving window, keeping peaks and the
+    slope through the penumbra better than a plain average.
+
+    Parameters
+    ----------
+    profiles : Profile or list of Profile
+    window : float, optional
+        cm
+    order : int, optional
+        polynomial order
+
+    Returns
+    -------
+    Profile or list of Profile
+
+    """
+    def func(y, step):
+        length = max(_samples(window, step), order + 2 - order % 2)
+        length = min(length, y.shape[1] - 1 + y.shape[1] % 2)
+        return signal.savgol_filter(y, length, order, axis=1)
+    return _apply(profiles, func)
+
+
+def median(profiles, window=0.5):
+    """ moving median, removing spikes while keeping edges sharp
+
+    Parameters
+    ----------
+    profiles : Profile or list of Profile
+    window : float, optional
+        cm
+
+    Returns
+    -------
+    Profile or list of Profile
+
+    """
+    def func(y, step):
+        return ndimage.median_filter(y, size=(1, _samples(window, step)), mode='nearest')
+    return _apply(profiles, func)
+
+
+def gaussian(profiles, sigma=0.1):
+    """ Gaussian smoothing
+
+    Parameters
+    ----------
+    profiles : Profile or list of Profile
+    sigma : float, optional
+        cm
+
+    Returns
+    -------
+    Profile or list of Profile
+
+    """
+    def func(y, step):
+        return ndimage.gaussian_filter1d(y, sigma / step, axis=1, mode='nearest')
+    return _apply(profiles, func)
@@ -29,6 +29,7 @@
 import os
 import copy
 import sys
+import contextlib
 
 from typing import Callable
 from scipy import interpolate
@@ -51,10 +52,201 @@ import re
 import time
 import pwlf
 
+import prof_kernels
+
 # NumpyFunction = Callable[[np.ndarray], np.ndarray]
 
 # pylint: disable = C0103, C0121, W0102
 
+_precision = None  # STORAGE DTYPE OF NEW PROFILES, None AS GIVEN
+
+def set_precision(dtype=None):
+    """ storage dtype of x and y in new Profiles
+
+    The policy is a module global, shared by every thread of the
+    process. The process pools of prof_batch.run, cross_calibrate_batch
+    and prof_server.Service start their workers with the policy in force
+    when the pool is created; later changes do not reach them.
+
+    Parameters
+    ----------
+    dtype : np.dtype or str, optional
+        e.g. 'float32' to halve memory, None to keep arrays as given
+
+    """
+    global _precision
+    _precision = None if dtype is None else np.dtype(dtype)
+
+@contextlib.contextmanager
+def precision(dtype):
+    """ set_precision within a with-block, e.g. while loading a collection
+
+    Not thread-safe: while the block runs, Profiles made by any thread,
+    such as in prof_align.align_many or behind the GUI, use dtype, and
+    nested blocks in different threads may restore each other's policy.
+
+    """
+    previous = _precision
+    set_precision(dtype)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
+def resample_grid(x, step=None, begin=None, end=None, num_points=None):
+    """ distances for Profile.resample_x, defaulting to the ends and mean step of x """
+    if not begin:
+        begin = min(x)
+    if not end:
+        end = max(x)
+    if not step:
+        try:
+            step = (end-begin)/num_points
+        except TypeError:
+            step = np.average(np.diff(x))
+    return np.arange(begin, end, step)
+
+def uniform_grid(x, rtol=1e-6):
+    """ (origin, step) if x increases in equal steps, else None
+
+    Each x must lie within rtol steps of the equal-step grid, allowing
+    also for the rounding of its dtype.
+
+    """
+    if len(x) < 2:
+        return None
+    steps = np.diff(x)
+    step = steps.mean()
+    if not step > 0 or steps.min() <= 0:
+        return None
+    eps = np.finfo(np.result_type(x.dtype, np.float32)).eps
+    tol = rtol * step + 4 * eps * max(abs(x[0]), abs(x[-1]))
+    if np.all(np.abs(x - (x[0] + step * np.arange(len(x)))) <= tol):
+        return (x[0], step)
+    return None
+
+class UniformInterp():
+    """ linear interpolation on a uniform grid, with fill 0
+
+    Gives the same values as interpolate.interp1d, finding each interval
+    by index arithmetic rather than binary search.
+
+    """
+
+    def __init__(self, x, y, origin, step):
+        self.x = x if np.issubdtype(x.dtype, np.floating) else x.astype(float)
+        self.y = y if np.issubdtype(y.dtype, np.floating) else y.astype(float)
+        self.origin = origin
+        self.step = step
+
+    def index(self, x_new):
+        """ interval j of each x_new, where x[j] <= x_new < x[j+1] """
+        last = len(self.x) - 2
+        pos = np.clip((x_new - self.origin) / self.step, -1, last + 2)
+        j = np.clip(np.nan_to_num(np.floor(pos)).astype(int), 0, last)
+        j = np.clip(j - (x_new < self.x[j]), 0, last)  # ROUNDING
+        return np.clip(j + (x_new >= self.x[j+1]), 0, last)
+
+    def __call__(self, x_new):
+        x_new = np.asarray(x_new, dtype=float)
+        j = self.index(x_new)
+        x_lo, y_lo = self.x[j], self.y[j]
+        slope = (self.y[j+1] - y_lo) / (self.x[j+1] - x_lo)
+        result = slope*(x_new - x_lo) + y_lo  # AS np.interp
+        result = np.where(x_new == self.x[-1], self.y[-1], result)
+        return np.where((x_new < self.x[0]) | (x_new > self.x[-1]), 0.0, result)
+
+class SplineInterp():
+    """ monotone cubic (PCHIP) or cubic spline interpolation, with fill 0 """
+
+    def __init__(self, x, y, kind):
+        order = np.argsort(x, kind='mergesort')
+        self.x = np.asarray(x, dtype=float)[order]
+        spline = {'pchip': interpolate.PchipInterpolator,
+                  'cubic': interpolate.CubicSpline}[kind]
+        self.spline = spline(self.x, np.asarray(y, dtype=float)[order], extrapolate=False)
+
+    def __call__(self, x_new):
+        x_new = np.asarray(x_new, dtype=float)
+        outside = (x_new < self.x[0]) | (x_new > self.x[-1])
+        return np.where(outside, 0.0, self.spline(x_new))
+
+INTERP_KINDS = ('linear', 'pchip', 'cubic')
+
+class MergedGrid():
+    """ common sample points for arithmetic between profiles
+
+    Positions and weights for linear interpolation from each of two grids
+    are found once, so any number of profile pairs on those grids can be
+    combined by indexing alone.
+
+    Attributes
+    ----------
+    x : np.array
+        points of both grids, within their overlap unless overlap is False
+    sources : tuple
+        (first grid, second grid)
+
+    Examples
+    --------
+    ``merged = MergedGrid(measured[0].x, planned.x)``
+    ``ratios = [merged.ratio(m, planned) for m in measured]``
+
+    """
+
+    def __init__(self, x1, x2, overlap=True):
+        self.sources = (np.asarray(x1), np.asarray(x2))
+        x = np.union1d(*self.sources)
+        if overlap:
+            lo = max(s.min() for s in self.sources)
+            hi = min(s.max() for s in self.sources)
+            x = x[(x >= lo) & (x <= hi)]
+        self.x = x
+        self._weights = [self._weights_from(s) for s in self.sources]
+
+    def _weights_from(self, source):
+        order = np.argsort(source, kind='mergesort')
+        xs = source[order]
+        j = np.clip(np.searchsorted(xs, self.x, side='right') - 1, 0, len(xs) - 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = (self.x - xs[j]) / (xs[j+1] - xs[j])
+        outside = (self.x < xs[0]) | (self.x > xs[-1])
+        return order[j], order[j+1], w, outside
+
+    def sample(self, profile, side=0):
+        """ y of profile at x, profile being on the first or second grid
+
+        Raises
+        ------
+        ValueError
+            if profile is not on that grid
+
+        """
+        source = self.sources[side]
+        if not np.array_equal(profile.x, source):
+            raise ValueError('profile is not on the merged grid')
+        if profile.kind != 'linear':
+            return profile.interp(self.x)
+        lo, hi, w, outside = self._weights[side]
+        y = np.asarray(profile.y, dtype=float)
+        return np.where(outside, 0.0, y[lo] + w*(y[hi] - y[lo]))
+
+    def combine(self, func, first, second):
+        """ Profile of func(first y, second y) at x """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            new_y = func(self.sample(first, 0), self.sample(second, 1))
+        return Profile(x=self.x, y=new_y, meta=first.meta, kind=first.kind)
+
+    def difference(self, first, second):
+        return self.combine(np.subtract, first, second)
+
+    def ratio(self, first, second):
+        return self.combine(np.divide, first, second)
+
+    def average(self, first, second, weight=0.5):
+        """ weight of first plus (1 - weight) of second """
+        return self.combine(lambda a, b: weight*a + (1 - weight)*b, first, second)
+
 class Profile():
     """  One-dimensional distribution of intensity vs position.
 
@@ -66,6 +258,8 @@ class Profile():
         intensity in unspecified units
     meta : dict, optional
         metadata
+    kind : str
+        interpolation, one of INTERP_KINDS
 
     Notes
     -----
@@ -74,7 +268,7 @@ class Profile():
     """
 
     def __init__(self, x=np.array([]),
-                 y=np.array([]), meta={}):
+                 y=np.array([]), meta={}, kind='linear'):
         """ create profile
 
         Parameters
@@ -82,6 +276,8 @@ class Profile():
         x : np.array, optional
         y : np.array, optional
         meta : dict, optional
+        kind : str, optional
+            'linear', 'pchip' for monotone cubic, or 'cubic' spline
 
         Notes
         -----
@@ -89,14 +285,33 @@ class Profile():
         a new Profile.
 
         """
-        self.x = np.array(x)
-        self.y = np.array(y)
+        self.x = np.array(x, dtype=_precision)
+        self.y = np.array(y, dtype=_precision)
         self.meta = meta
-        if len(self.x) < 2:
-            self.interp = None
-        else:
-            self.interp = interpolate.interp1d(self.x, self.y,
-                                               bounds_error=False, fill_value=0.0)
+        if kind not in INTERP_KINDS:
+            raise ValueError('unknown interpolation: {}'.format(kind))
+        self.kind = kind
+        self.grid = uniform_grid(self.x)
+        self._interp = None
+        self._pyramid = None
+
+    @property
+    def interp(self):
+        """ interpolating function, of the profile's kind
+
+        Built on first use and cached, so its coefficients are computed
+        once for all later get_y, get_x, resample_x and align_to calls.
+
+        """
+        if self._interp is None and len(self.x) >= 2:
+            if self.kind != 'linear':
+                self._interp = SplineInterp(self.x, self.y, self.kind)
+            elif self.grid:
+                self._interp = UniformInterp(self.x, self.y, *self.grid)
+            else:
+                self._interp = interpolate.interp1d(self.x, self.y,
+                                                    bounds_error=False, fill_value=0.0)
+        return self._interp
 
     def __len__(self):
         """ # data points  """
@@ -132,26 +347,40 @@ class Profile():
             return ''  # EMPTY PROFILE
 
     def __add__(self, other):
-        """ shift right """
+        """ shift right, or sum with a Profile on their merged grid """
+        if isinstance(other, Profile):
+            return MergedGrid(self.x, other.x).combine(np.add, self, other)
         new_x = self.x + other
-        return Profile(x=new_x, y=self.y, meta=self.meta)
+        return Profile(x=new_x, y=self.y, meta=self.meta, kind=self.kind)
     __radd__ = __add__
     __iadd__ = __add__
 
     def __sub__(self, other):
-        """ shift left """
-        self.x -= other
-        return Profile(x=self.x, y=self.y, meta=self.meta)
+        """ shift left, or difference from a Profile on their merged grid """
+        if isinstance(other, Profile):
+            return MergedGrid(self.x, other.x).difference(self, other)
+        new_x = self.x - other
+        return Profile(x=new_x, y=self.y, meta=self.meta, kind=self.kind)
     __rsub__ = __sub__
     __isub__ = __sub__
 
     def __mul__(self, other):
-        """ scale y """
-        self.y *= other
-        return self
+        """ scale y, or product with a Profile on their merged grid """
+        if isinstance(other, Profile):
+            return MergedGrid(self.x, other.x).combine(np.multiply, self, other)
+        new_y = self.y * other
+        return Profile(x=self.x, y=new_y, meta=self.meta, kind=self.kind)
     __rmul__ = __mul__
     __imul__ = __mul__
 
+    def __truediv__(self, other):
+        """ scale y by 1/other, or ratio to a Profile on their merged grid """
+        if isinstance(other, Profile):
+            return MergedGrid(self.x, other.x).ratio(self, other)
+        new_y = self.y / other
+        return Profile(x=self.x, y=new_y, meta=self.meta, kind=self.kind)
+    __itruediv__ = __truediv__
+
 
     def get_y(self, x):
         """ y-value at distance x
@@ -190,18 +419,8 @@ class Profile():
          """
 
         dose_step = (max(self.y)-min(self.y)) / 100
-        x_ = self.resample_y(dose_step).x
-        y_ = self.resample_y(dose_step).y
-        dists = []
-        for i in range(1, len(x_)):
-            val = None
-            if (y_[i]-y)*(y_[i-1]-y) < 0:
-                val = (x_[i]-((y_[i]-y)/(y_[i]-y_[i-1]))*(x_[i]-x_[i-1]))
-            elif np.isclose(y_[i], y):
-                val = x_[i]
-            if val and (val not in dists):
-                dists.append(val)
-        return tuple(dists)
+        resampled = self.resample_y(dose_step)
+        return tuple(prof_kernels.crossings(resampled.x, resampled.y, y))
 
     def get_increment(self):
         """ minimum step-size increment
@@ -211,6 +430,8 @@ class Profile():
         increment : float
 
         """
+        if self.grid:
+            return self.grid[1]
         steps = np.diff(self.x)
         if np.isclose(steps.min(), steps.mean()):
             return steps.mean()
@@ -250,6 +471,12 @@ class Profile():
         Profile
 
         """
+        if self.grid:  # INDEX ARITHMETIC
+            start, stop = np.array([start, stop], dtype=float).ravel()
+            lo, hi = UniformInterp(self.x, self.y, *self.grid).index(np.array([start, stop]))
+            lo += int(start > self.x[lo]) + int(start > self.x[lo+1])
+            hi += int(stop >= self.x[hi+1]) - int(stop < self.x[hi])
+            return Profile(self.x[lo:hi+1], self.y[lo:hi+1], kind=self.kind)
         try:
             start = max(start, min(self.x))  # default & limit to curve ends
             stop = min(stop, max(self.x))
@@ -259,7 +486,7 @@ class Profile():
             new_x = []
             new_y = []
 
-        return Profile(new_x, new_y)
+        return Profile(new_x, new_y, kind=self.kind)
 
 
     def resample_x(self, step=None, begin=None, end=None, num_points=None):
@@ -281,19 +508,9 @@ class Profile():
 
         """
 
-        if not begin:
-            begin = min(self.x)
-        if not end:
-            end = max(self.x)
-        if not step:
-            try: 
-                step = (end-begin)/num_points
-            except TypeError:
-                step = np.average(np.diff(self.x))
-
-        new_x = np.arange(begin, end, step)
+        new_x = resample_grid(self.x, step, begin, end, num_points)
         new_y = self.get_y(new_x)
-        return Profile(new_x, new_y, self.meta)
+        return Profile(new_x, new_y, self.meta, kind=self.kind)
 
 
     def resample_y(self, step):
@@ -317,22 +534,11 @@ class Profile():
                            0.01*self.get_increment())
         temp_y = self.interp(temp_x)
 
-        resamp_x = [temp_x[0]]
-        resamp_y = [temp_y[0]]
-
-        last_y = temp_y[0]
-
-        for i, _ in enumerate(temp_x):
-            if np.abs(temp_y[i] - last_y) >= step:
-                resamp_x.append(temp_x[i])
-                resamp_y.append(temp_y[i])
-                last_y = temp_y[i]
-
-        if temp_x[-1] not in resamp_x:
-            resamp_x.append(temp_x[-1])
-            resamp_y.append(temp_y[-1])
+        keep = np.concatenate(([0], prof_kernels.threshold_walk(temp_y, step)))
+        if keep[-1] != len(temp_x) - 1:
+            keep = np.append(keep, len(temp_x) - 1)
 
-        return Profile(x=np.array(resamp_x), y=np.array(resamp_y), meta=self.meta)
+        return Profile(x=temp_x[keep], y=temp_y[keep], meta=self.meta, kind=self.kind)
 
     def make_normal_y(self, x=0.0, y=1.0):
         """ normalised to dose at distance
@@ -355,7 +561,7 @@ class Profile():
         norm_factor = y / self.get_y(x)
         new_x = self.x
         new_y = norm_factor * self.y
-        return Profile(new_x, new_y, meta=self.meta)
+        return Profile(new_x, new_y, meta=self.meta, kind=self.kind)
 
     def get_edges(self):
         """ x-values of profile edges (left, right)
@@ -369,7 +575,8 @@ class Profile():
         tuple
 
         """
-        dydx = list(np.gradient(self.y, self.x))
+        dydx = list(np.gradient(np.asarray(self.y, dtype=float),
+                                np.asarray(self.x, dtype=float)))
         lt_edge = self.x[dydx.index(max(dydx))]
         rt_edge = self.x[dydx.index(min(dydx))]
         return (lt_edge, rt_edge)
@@ -406,7 +613,7 @@ class Profile():
             else:
                 new_x.append(0.0)
 
-        return Profile(new_x, self.y, meta=self.meta)
+        return Profile(new_x, self.y, meta=self.meta, kind=self.kind)
 
     def slice_umbra(self):
         """ umbra central 80%
@@ -424,7 +631,7 @@ class Profile():
         new_x = self.x[idx[0]:idx[-1]+1]
         new_y = self.y[idx[0]:idx[-1]+1]
 
-        return Profile(x=new_x, y=new_y, meta=self.meta)
+        return Profile(x=new_x, y=new_y, meta=self.meta, kind=self.kind)
 
     def slice_penumbra(self):
         """ penumbra (20 -> 80%, 80 -> 20%)
@@ -524,7 +731,7 @@ class Profile():
         float
 
         """
-        dose = self.slice_umbra().y
+        dose = np.asarray(self.slice_umbra().y, dtype=float)
         return (max(dose)-min(dose))/np.average(dose)
 
     def get_symmetry(self):
@@ -538,9 +745,46 @@ class Profile():
         float
 
         """
-        dose = self.slice_umbra().y
+        dose = np.asarray(self.slice_umbra().y, dtype=float)
         return max(np.abs(np.subtract(dose, dose[::-1])/np.average(dose)))
 
+    def get_gamma(self, reference, dose=0.03, dist=0.3):
+        """ gamma index vs reference
+
+        One-dimensional gamma [1]_, with dose difference relative to the
+        reference maximum. The reference is resampled at one tenth of the
+        distance criterion, keeping its own points, before searching.
+
+        Parameters
+        ----------
+        reference : Profile
+        dose : float, optional
+            dose difference criterion, fraction of reference maximum
+        dist : float, optional
+            distance to agreement criterion, cm
+
+        Returns
+        -------
+        Profile
+            gamma at each distance of the source profile
+
+        References
+        ----------
+        .. [1] Low, Harms, Mutic & Purdy, Med Phys May-98, A technique for the
+           quantitative evaluation of dose distributions
+
+        """
+        ref_x = np.union1d(reference.resample_x(dist / 10).x, reference.x)
+        ref_y = reference.get_y(ref_x)
+        dose_diff = dose * max(reference.y)
+        gamma = np.empty(len(self.x))
+        for start in range(0, len(self.x), 1000):  # LIMIT MEMORY
+            x = self.x[start:start+1000, np.newaxis]
+            y = self.y[start:start+1000, np.newaxis]
+            gamma[start:start+1000] = np.sqrt(np.min(
+                ((ref_x - x) / dist)**2 + ((ref_y - y) / dose_diff)**2, axis=1))
+        return Profile(x=self.x, y=gamma, meta=self.meta)
+
     def make_symmetric(self):
         """ avg of corresponding points
 
@@ -553,16 +797,16 @@ class Profile():
 
         """
 
-        reflected = Profile(x=-self.x[::-1], y=self.y[::-1])
+        reflected = Profile(x=-self.x[::-1], y=self.y[::-1], kind=self.kind)
 
         step = self.get_increment()
         new_x = np.arange(min(self.x), max(self.x), step)
-        new_y = [self.y[0]]
-        for n in new_x[1:-1]:  # AVOID EXTRAPOLATION
-            new_y.append(0.5*self.interp(n) + 0.5*reflected.interp(n))
-        new_y.append(reflected.y[0])
+        inner = new_x[1:-1]  # AVOID EXTRAPOLATION
+        new_y = np.concatenate(([self.y[0]],
+                                0.5*self.interp(inner) + 0.5*reflected.interp(inner),
+                                [reflected.y[0]]))
 
-        return Profile(x=new_x, y=new_y, meta=self.meta)
+        return Profile(x=new_x, y=new_y, meta=self.meta, kind=self.kind)
 
     def make_centered(self):
         """ shift to align edges
@@ -577,6 +821,25 @@ class Profile():
 
         return self - np.average(self.get_edges())
 
+    def make_interp(self, kind='pchip'):
+        """ same points, other interpolation
+
+        Monotone cubic (PCHIP) follows sparse detector samples through the
+        penumbra without overshoot, so get_x and resample_x are accurate
+        without first resampling densely.
+
+        Parameters
+        ----------
+        kind : str, optional
+            one of INTERP_KINDS
+
+        Returns
+        -------
+        Profile
+
+        """
+        return Profile(x=self.x, y=self.y, meta=self.meta, kind=kind)
+
     def make_flipped(self):
         """ flip L -> R
 
@@ -588,9 +851,63 @@ class Profile():
 
         """
 
-        return Profile(x=self.x, y=self.y[::-1], meta=self.meta)
+        return Profile(x=self.x, y=self.y[::-1], meta=self.meta, kind=self.kind)
+
+    def get_pyramid(self, min_points=64):
+        """ successively halved copies, finest first
+
+        Each level averages neighbouring pairs of points of the level
+        before, while at least min_points remain. Built once and cached.
+
+        Parameters
+        ----------
+        min_points : int, optional
 
-    def align_to(self, other):
+        Returns
+        -------
+        list of Profile
+
+        """
+        if self._pyramid is None:
+            levels = [self]
+            while len(levels[-1]) >= 2 * min_points:
+                p = levels[-1]
+                n = len(p) // 2 * 2
+                levels.append(Profile(x=0.5*(p.x[0:n:2] + p.x[1:n:2]),
+                                      y=0.5*(p.y[0:n:2] + p.y[1:n:2]),
+                                      meta=p.meta, kind=p.kind))
+            self._pyramid = levels
+        return self._pyramid
+
+    def _coarse_to_fine(self, mirror, other, dist_vals_fixed, offsets, keep=4):
+        """ (offset index, flipped) worth trying at the finest level
+
+        The best few offsets at each pyramid level, searched first over
+        every offset at the coarsest, are refined over a window one
+        coarse step either side at the next level.
+
+        """
+        pyramids = {False: self.get_pyramid(), True: mirror.get_pyramid()}
+        fixed_pyramid = other.get_pyramid()
+        levels = min(len(fixed_pyramid), len(pyramids[False])) - 1
+        scale = 2**levels
+        candidates = [(i, f) for i in range(0, len(offsets), scale) for f in (False, True)]
+        for level in range(levels, 0, -1):
+            scale = 2**level
+            fixed_x = dist_vals_fixed[::scale]
+            fixed_y = fixed_pyramid[level].interp(fixed_x)
+
+            def quality(candidate):
+                i, flip = candidate
+                return np.dot(fixed_y, pyramids[flip][level].interp(fixed_x - offsets[i]))
+
+            best = sorted(candidates, key=quality, reverse=True)[:keep]
+            half = scale // 2
+            candidates = sorted({(min(max(i + d*half, 0), len(offsets) - 1), f)
+                                 for i, f in best for d in range(-2, 3)})
+        return candidates
+
+    def align_to(self, other, coarse_to_fine=False):
         """ shift self to align to other
 
         Calculated using shift that produces greatest peak correlation between
@@ -600,6 +917,9 @@ class Profile():
         ----------
         other : Profile
             profile to be be shifted to
+        coarse_to_fine : bool, optional
+            search the pyramids of both profiles, from coarse to fine,
+            instead of every offset at full resolution, for large profiles
 
         Returns
         -------
@@ -621,23 +941,35 @@ class Profile():
             min(max(other.x), max(self.x)) + dist_step,
             dist_step)
 
+        mirror = self.make_flipped()  # EACH INTERPOLATOR BUILT ONCE
+        if coarse_to_fine:
+            candidates = self._coarse_to_fine(mirror, other, dist_vals_fixed,
+                                              possible_offsets)
+        else:
+            candidates = [(i, f) for i in range(len(possible_offsets))
+                          for f in (False, True)]
+
+        fit_quals = {}
+        for flip, source in ((False, self), (True, mirror)):
+            indices = [i for i, f in candidates if f == flip]
+            if source.kind == 'linear':
+                order = np.argsort(source.x, kind='mergesort')
+                quals = prof_kernels.scan_offsets(
+                    fixed.x, dose_vals_fixed, source.x[order], source.y[order],
+                    possible_offsets[indices])
+            else:
+                quals = [max(np.correlate(
+                    dose_vals_fixed,
+                    source.interp(fixed.x - possible_offsets[i]))) for i in indices]
+            fit_quals.update(zip(((i, flip) for i in indices), quals))
+
         best_fit_qual, best_offset, flipped = 0, -np.inf, False
-        for offset in possible_offsets:
-            fit_qual_norm = max(np.correlate(
-                dose_vals_fixed,
-                (self + offset).interp(fixed.x)))
-            fit_qual_flip = max(np.correlate(
-                dose_vals_fixed,
-                (self.make_flipped() + offset).interp(fixed.x)))
-
-            if fit_qual_norm > best_fit_qual:
-                best_fit_qual = fit_qual_norm
-                best_offset = offset
-                flipped = False
-            if fit_qual_flip > best_fit_qual:
-                best_fit_qual = fit_qual_flip
-                best_offset = offset
-                flipped = True
+        for i, flip in candidates:  # BY OFFSET, UNFLIPPED FIRST
+            fit_qual = fit_quals[(i, flip)]
+            if fit_qual > best_fit_qual:
+                best_fit_qual = fit_qual
+                best_offset = possible_offsets[i]
+                flipped = flip
 
         if flipped:
             return self.make_flipped() + best_offset
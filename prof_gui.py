@@ -46,11 +46,57 @@ from matplotlib.figure import Figure
 
 from functools import partial
 import PIL
+import time
+import concurrent.futures
 
 from prof_funct import Profile
+import profile_from
+import cross_calibrate
 
 # pylint: disable = C0103, C0121, W0102
 
+def _decimate(x, y, width, start=-np.inf, stop=np.inf):
+    """ min/max decimation for plotting
+
+    Points between start and stop, plus one either side, are split into
+    width bins, and the first, last, min and max points of each bin are
+    kept in order. Peaks and edges are drawn as at full resolution.
+
+    Parameters
+    ----------
+    x : np.array
+        ascending
+    y : np.array
+    width : int
+        number of bins, i.e. pixel columns
+    start : float, optional
+    stop : float, optional
+
+    Returns
+    -------
+    tuple
+        (x, y)
+
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if len(x) and x[0] <= x[-1]:
+        lo = max(np.searchsorted(x, start) - 1, 0)
+        hi = min(np.searchsorted(x, stop, side='right') + 1, len(x))
+        x, y = x[lo:hi], y[lo:hi]
+    width = max(int(width), 1)
+    if len(x) <= 4 * width:
+        return x, y
+
+    per_bin = -(-len(y) // width)
+    padded = np.concatenate((y, np.full(per_bin * width - len(y), y[-1])))
+    bins = padded.reshape(width, per_bin)
+    first = np.arange(width) * per_bin
+    idx = np.concatenate((first, first + per_bin - 1,
+                          first + bins.argmin(axis=1),
+                          first + bins.argmax(axis=1)))
+    idx = np.unique(np.minimum(idx, len(y) - 1))
+    return x[idx], y[idx]
+
 class GUI(tk.Frame):
     """ Graphical User Interface for Profile Class
 
@@ -77,6 +123,7 @@ class GUI(tk.Frame):
         self.toolbar.update()
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
         self.canvas.mpl_connect("key_press_event", self.on_key_press)
+        self.subplot.callbacks.connect('xlim_changed', self.on_xlim_changed)
 
         self.status = tk.StringVar()
         self.status_bar = tk.Frame(master=graph_frame, relief=tk.RIDGE, background="bisque")
@@ -111,6 +158,7 @@ class GUI(tk.Frame):
         __from.add_command(label="RFA ASCII", command=self.from_rfa_ascii)
         __from.add_command(label="Pinnacle ASCII", command=self.from_pinnacle_ascii)
         __from.add_command(label="X-Calib", command=self.from_cross_calibration)
+        _file.add_command(label="Cancel", command=self.cancel)
         _file.add_command(label="Clear Selected", command=self.file_clr)
         _file.add_command(label="Clear All", command=self.file_clr_all)
         _file.add_command(label="Exit", command=self._quit)
@@ -146,7 +194,20 @@ class GUI(tk.Frame):
 
         self.selector = tk.Frame(selector_frame)
         self.selector.pack(side=tk.TOP, fill="both", expand=True)
+        selector_title = tk.Label(master=self.selector, width=10,
+                                  bg='white', text='Selector')
+        selector_title.pack(side="top", fill="both", expand=True)
         self.selected_profile = tk.IntVar(value=0)
+        self._plotted = []  # PROFILES CURRENTLY SHOWN, PARALLEL TO LINES
+        self._bounds = []  # (x_min, y_min, x_max, y_max), PARALLEL TO LINES
+        self._limits = None  # UNION OF _bounds, AS LAST AUTOSCALED
+        self._xlim = None  # VIEW THE LINES ARE DECIMATED TO
+        self.lines = []
+        self.buttons = []
+        self._active_button = None
+        self._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._jobs = []  # (msg, future, on_done, start time), IN ORDER
+        self._polling = False
         self.update('__init__')
         self.canvas.draw()
 
@@ -154,47 +215,193 @@ class GUI(tk.Frame):
         assert cmd in ('get', 'next', 'reset')
         if cmd == 'next':
             self._color_palette['idx'] += 1
+            self._color_palette['idx'] %= len(self._color_palette['val'])
         elif cmd == 'reset':
             self._color_palette['idx'] = 0
         return self._color_palette['val'][self._color_palette['idx']]
 
     def select_active(self, i):
-        for J in range(len(self.buttons)):
-            self.buttons[J].config(relief=tk.RAISED)
+        if self._active_button and self._active_button.winfo_exists():
+            self._active_button.config(relief=tk.RAISED)
         self.selected_profile.set(i)
         self.buttons[i].config(relief=tk.SUNKEN)
+        self._active_button = self.buttons[i]
 
     def update(self, msg):
-        self._color('reset')
-        self.subplot.cla()
-        self.buttons = []
-        for button in self.selector.winfo_children():
-            button.destroy()
-        selector_title = tk.Label(master=self.selector, width=10,
-                                  bg='white', text='Selector')
-        selector_title.pack(side="top", fill="both", expand=True)
-        for i,profile in enumerate(self.profiles):
-            self.subplot.plot(profile.x, profile.y, color=self._color('get'))
-            button = tk.Button(master=self.selector,
-                        bg=self._color('get'), text=str(i), width=8,
-                        command=partial(self.select_active, i))
+        """ sync plot and selector with self.profiles
+
+        Profiles that are unchanged since the last update keep their
+        line and button. A replaced profile reuses the artists of the one
+        it replaces, so only added, removed or replaced profiles are
+        touched. Data bounds are kept per profile, and the view is only
+        rescaled, re-decimating every line, when their union changes.
+        Redraw is deferred to draw_idle.
+
+        """
+        current = {id(profile) for profile in self.profiles}
+        previous = {id(profile): i for i, profile in enumerate(self._plotted)}
+        spare = [i for i, profile in enumerate(self._plotted)
+                 if id(profile) not in current]
+
+        lines, buttons, bounds = [], [], []
+        for profile in self.profiles:
+            i = previous.get(id(profile))
+            if i is not None:
+                bounds.append(self._bounds[i])
+            elif len(profile):
+                bounds.append((np.min(profile.x), np.min(profile.y),
+                               np.max(profile.x), np.max(profile.y)))
+            else:
+                bounds.append(None)
+            if i is None and spare:
+                i = spare.pop(0)
+                self.lines[i].set_data(*self._line_data(profile))
+            if i is None:
+                color = self._color('get')
+                self._color('next')
+                line, = self.subplot.plot(*self._line_data(profile), color=color)
+                button = tk.Button(master=self.selector, bg=color, width=8)
+            else:
+                line, button = self.lines[i], self.buttons[i]
+            lines.append(line)
+            buttons.append(button)
+
+        for i in spare:
+            self.lines[i].remove()
+            self.buttons[i].destroy()
+
+        first_moved = len(buttons)
+        for i, button in enumerate(buttons):
+            if i >= len(self.buttons) or button is not self.buttons[i]:
+                first_moved = i
+                break
+        for i, button in enumerate(buttons[first_moved:], first_moved):
+            button.config(text=str(i), command=partial(self.select_active, i))
+            button.pack_forget()
             button.pack(side=tk.TOP, fill='both')
-            self.buttons.append(button)
-            self._color('next')
+
+        self._plotted = list(self.profiles)
+        self.lines, self.buttons, self._bounds = lines, buttons, bounds
+        if not self.profiles:
+            self._color('reset')
+        known = [b for b in bounds if b is not None]
+        limits = (min(b[0] for b in known), min(b[1] for b in known),
+                  max(b[2] for b in known), max(b[3] for b in known)) if known else None
+        if limits is not None and limits != self._limits:
+            # LIMITS FROM FULL DATA, LINES MAY BE DECIMATED TO VIEW
+            self._limits = limits
+            self.subplot.ignore_existing_data_limits = True
+            self.subplot.update_datalim([limits[:2], limits[2:]])
+            self.subplot.autoscale_view()  # on_xlim_changed RE-DECIMATES
         try:
             self.select_active(self.selected_profile.get())
         except IndexError:
             pass
         self.status.set(msg)
-        self.canvas.draw()
+        self.canvas.draw_idle()
+
+    def _line_data(self, profile):
+        """ profile decimated to the axes pixel width, over the x view """
+        width = self.subplot.get_window_extent().width
+        return _decimate(profile.x, profile.y, width, *self.subplot.get_xlim())
+
+    def on_xlim_changed(self, axes):
+        """ re-decimate from full resolution after zoom or pan
+
+        Only when the visible x range has changed, not on every callback.
+
+        """
+        xlim = tuple(axes.get_xlim())
+        if xlim == self._xlim:
+            return
+        self._xlim = xlim
+        for profile, line in zip(self._plotted, self.lines):
+            line.set_data(*self._line_data(profile))
+        self.canvas.draw_idle()
+
+    def _run(self, msg, func, on_done):
+        """ run func() on the worker thread, then on_done(result) on the Tk thread
+
+        Jobs run one at a time, in order. Progress is shown in the status
+        bar until the job is done or cancelled.
+
+        """
+        future = self._worker.submit(func)
+        self._jobs.append((msg, future, on_done, time.time()))
+        if not self._polling:
+            self._polling = True
+            self.after(100, self._poll)
+
+    def _poll(self):
+        """ hand finished jobs to on_done, in order, and show progress
+
+        Errors in a job or in its on_done are shown in the status bar.
+        Polling stops once no jobs are left, even after an error.
+
+        """
+        polling = False
+        try:
+            while self._jobs and self._jobs[0][1].done():
+                msg, future, on_done, _ = self._jobs.pop(0)
+                try:
+                    on_done(future.result())
+                except concurrent.futures.CancelledError:
+                    continue
+                except Exception as error:  # pylint: disable = W0703
+                    self.status.set('{} failed: {}'.format(msg, error))
+                    continue
+            if self._jobs:
+                msg, _, _, start = self._jobs[0]
+                status = '{} ... {:.0f} s'.format(msg, time.time() - start)
+                if len(self._jobs) > 1:
+                    status += ' ({} queued)'.format(len(self._jobs) - 1)
+                self.status.set(status)
+                self.after(100, self._poll)
+                polling = True
+        finally:
+            self._polling = polling
+
+    def cancel(self):
+        """ cancel queued jobs and discard the result of the running one """
+        for _, future, _, _ in self._jobs:
+            future.cancel()
+        if self._jobs:
+            self.status.set('cancelled')
+        self._jobs = []
+
+    def _add(self, msg, result):
+        """ append result, a Profile or list of Profiles, and select it """
+        if not isinstance(result, (list, tuple)):
+            result = [result]
+        self.profiles = self.profiles + list(result)
+        self.update(msg)
+        self.select_active(len(self.profiles)-1)
+
+    def _replace(self, source, msg, result):
+        """ replace source, if still loaded, with result, a Profile or tuple """
+        if not isinstance(result, (list, tuple)):
+            result = [result]
+        for p, profile in enumerate(self.profiles):
+            if profile is source:
+                self.profiles = self.profiles[:p] + list(result) + self.profiles[(p+1):]
+                break
+        self.update(msg)
+
+    def _run_selected(self, msg, method, *args, **kwargs):
+        """ run a Profile method on the selected profile and replace it """
+        try:
+            source = self.profiles[self.selected_profile.get()]
+        except IndexError:
+            return
+        self._run(msg, partial(getattr(source, method), *args, **kwargs),
+                  partial(self._replace, source, msg))
 
     def from_narrow_png(self):
         filename = askopenfilename(
             initialdir=self.data_folder, title="Film File",
             filetypes=(("Film Files", "*.png"), ("all files", "*.*")))
-        self.profiles.append(Profile().from_narrow_png(filename))
-        self.update('from_narrow_png')
-        self.select_active(len(self.profiles)-1)
+        self._run('from_narrow_png', partial(profile_from.narrow_png, filename),
+                  partial(self._add, 'from_narrow_png'))
 
     def from_pulse(self):
         pulse_window = tk.Tk()
@@ -212,10 +419,8 @@ class GUI(tk.Frame):
         def OK():
             p = [v.get() for v in variables]
             p = [p[0], p[1], (p[2], p[3]), p[4]]
-            self.profiles.append(Profile().from_pulse(*p))
-            self.selected_profile.set(len(self.profiles)-1)
-            self.update('from_pulse')
-            self.select_active(len(self.profiles)-1)
+            self._run('from_pulse', partial(profile_from.pulse, *p),
+                      partial(self._add, 'from_pulse'))
             pulse_window.destroy()
         ok_button = tk.Button(pulse_window, text="OK", command=OK)
         ok_button.grid(column=0, row=6, columnspan=2)
@@ -225,36 +430,34 @@ class GUI(tk.Frame):
         filename = askopenfilename(
             initialdir=self.data_folder, title="SNC Profiler",
             filetypes=(("Profiler Files", "*.prs"), ("all files", "*.*")))
-        self.profiles.append(Profile().from_snc_profiler(filename, 'rad'))
-        self.profiles.append(Profile().from_snc_profiler(filename, 'tvs'))
-        self.update('from_snc_profiler')
-        self.select_active(len(self.profiles)-1)
+        def load():
+            return [profile_from.snc_profiler(filename, 'rad'),
+                    profile_from.snc_profiler(filename, 'tvs')]
+        self._run('from_snc_profiler', load,
+                  partial(self._add, 'from_snc_profiler'))
 
     def from_raystation_line(self):
         filename = askopenfilename(
             initialdir=self.data_folder, title="Film File",
             filetypes=(("CSV Files", "*.csv"), ("all files", "*.*")))
-        self.profiles.append(Profile().from_raystation_line(filename))
-        self.update('from_raystation_line')
-        self.select_active(len(self.profiles)-1)
+        self._run('from_raystation_line',
+                  partial(profile_from.raystation_line, filename),
+                  partial(self._add, 'from_raystation_line'))
 
     def from_rfa_ascii(self):
         filename = askopenfilename(
             initialdir=self.data_folder, title="RFA File",
             filetypes=(("ASC Files", "*.asc"), ("all files", "*.*")))
-        for profile in Profile().from_rfa_ascii(filename):
-            self.profiles.append(profile)
-            self.update('from_rfa_ascii')
-        self.select_active(len(self.profiles)-1)
+        self._run('from_rfa_ascii', partial(profile_from.rfa_ascii, filename),
+                  partial(self._add, 'from_rfa_ascii'))
 
     def from_pinnacle_ascii(self):
         filename = askopenfilename(
             initialdir=self.data_folder, title="DAT File",
             filetypes=(("Pinnacle Files", "*.dat"), ("all files", "*.*")))
-        for profile in Profile().from_pinnacle_ascii(filename):
-            self.profiles.append(profile)
-            self.update('from_pinnacle_ascii')
-        self.select_active(len(self.profiles)-1)
+        self._run('from_pinnacle_ascii',
+                  partial(profile_from.pinnacle_ascii, filename),
+                  partial(self._add, 'from_pinnacle_ascii'))
 
     def from_cross_calibration(self):
         profiler_filename = askopenfilename(
@@ -263,10 +466,12 @@ class GUI(tk.Frame):
         film_filename = askopenfilename(
             initialdir=self.data_folder, title="Film File",
             filetypes=(("Film Files", "*.png"), ("all files", "*.*")))
-
-        self.profiles.append(Profile().cross_calibrate(profiler_filename,film_filename))
-        self.update('from_cross_calibration')
-        self.select_active(len(self.profiles)-1)
+        def calibrate():  # CURVE AS A PROFILE, DOSE VS DENSITY
+            curve = cross_calibrate.cross_calibrate(profiler_filename, film_filename)
+            density = np.linspace(0.0, 1.0, 101)
+            return Profile(x=density, y=curve(density))
+        self._run('from_cross_calibration', calibrate,
+                  partial(self._add, 'from_cross_calibration'))
 
     def file_clr(self):
         self.profiles.pop(self.selected_profile.get())
@@ -367,31 +572,13 @@ class GUI(tk.Frame):
         win.mainloop()
 
     def make_centered(self):
-        try:
-            p = self.selected_profile.get()
-            new_profile = self.profiles[p].make_centered()
-            self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-            self.update('make_centered')
-        except IndexError:
-            pass
+        self._run_selected('make_centered', 'make_centered')
 
     def make_flipped(self):
-        try:
-            p = self.selected_profile.get()
-            new_profile = self.profiles[p].make_flipped()
-            self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-            self.update('make_flipped')
-        except IndexError:
-            pass
+        self._run_selected('make_flipped', 'make_flipped')
 
     def make_normal_x(self):
-        try:
-            p = self.selected_profile.get()
-            new_profile = self.profiles[p].make_normal_x()
-            self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-            self.update('normalise_x')
-        except IndexError:
-            pass
+        self._run_selected('normalise_x', 'make_normal_x')
 
     def make_normal_y(self):
         norm_window = tk.Tk()
@@ -408,26 +595,15 @@ class GUI(tk.Frame):
         x_entry.grid(column=1, row=0)
         y_entry.grid(column=1, row=1)
         def OK():
-            try:
-                p = self.selected_profile.get()
-                new_profile = self.profiles[p].make_normal_y(x=float(x.get()),y=float(y.get()))
-                self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-                self.update('make_normal_y')
-            except IndexError:
-                pass
+            self._run_selected('make_normal_y', 'make_normal_y',
+                               x=float(x.get()), y=float(y.get()))
             norm_window.destroy()
         ok_button = tk.Button(norm_window, text="OK", command=OK)
         ok_button.grid(column=0, row=10, columnspan=2)
         norm_window.mainloop()
 
     def make_symmetric(self):
-        try:
-            p = self.selected_profile.get()
-            new_profile = self.profiles[p].make_symmetric()
-            self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-            self.update('make_symmetric')
-        except IndexError:
-            pass
+        self._run_selected('make_symmetric', 'make_symmetric')
 
     def resample_x(self):
         step_window = tk.Tk()
@@ -439,13 +615,7 @@ class GUI(tk.Frame):
         label.grid(column=0, row=0, sticky=tk.E)
         entry.grid(column=1, row=0)
         def OK():
-            try:
-                p = self.selected_profile.get()
-                new_profile = self.profiles[p].resample_x(float(step.get()))
-                self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-                self.update('resample_x')
-            except IndexError:
-                pass
+            self._run_selected('resample_x', 'resample_x', float(step.get()))
             step_window.destroy()
         ok_button = tk.Button(step_window, text="OK", command=OK)
         ok_button.grid(column=0, row=10, columnspan=2)
@@ -461,23 +631,14 @@ class GUI(tk.Frame):
         label.grid(column=0, row=0, sticky=tk.E)
         entry.grid(column=1, row=0)
         def OK():
-            try:
-                p = self.selected_profile.get()
-                new_profile = self.profiles[p].resample_y(float(step.get()))
-                self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-                self.update('resample_y')
-            except IndexError:
-                pass
+            self._run_selected('resample_y', 'resample_y', float(step.get()))
             step_window.destroy()
         ok_button = tk.Button(step_window, text="OK", command=OK)
         ok_button.grid(column=0, row=10, columnspan=2)
         step_window.mainloop()
 
     def slice_penumbra(self):
-        p = self.selected_profile.get()
-        (new_profile1,new_profile2) = self.profiles[p].slice_penumbra()
-        self.profiles = self.profiles[:p] + [new_profile1, new_profile2] + self.profiles[(p+2):]
-        self.update('slice_penumbra')
+        self._run_selected('slice_penumbra', 'slice_penumbra')
 
     def slice_segment(self):
         seg_window = tk.Tk()
@@ -494,41 +655,29 @@ class GUI(tk.Frame):
         start_entry.grid(column=1, row=0)
         stop_entry.grid(column=1, row=1)
         def OK():
-            try:
-                p = self.selected_profile.get()
-                new_profile = self.profiles[p].slice_segment(start=float(start.get()),stop=float(stop.get()))
-                self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-                self.update('slice_segment')
-            except IndexError:
-                pass
+            self._run_selected('slice_segment', 'slice_segment',
+                               start=float(start.get()), stop=float(stop.get()))
             seg_window.destroy()
         ok_button = tk.Button(seg_window, text="OK", command=OK)
         ok_button.grid(column=0, row=10, columnspan=2)
         seg_window.mainloop()
 
     def slice_shoulders(self):
-        p = self.selected_profile.get()
-        (new_profile1,new_profile2) = self.profiles[p].slice_shoulders()
-        self.profiles = self.profiles[:p] + [new_profile1, new_profile2] + self.profiles[(p+2):]
-        self.update('slice_shoulders')
+        self._run_selected('slice_shoulders', 'slice_shoulders')
 
     def slice_tails(self):
-        p = self.selected_profile.get()
-        (new_profile1,new_profile2) = self.profiles[p].slice_tails()
-        self.profiles = self.profiles[:p] + [new_profile1, new_profile2] + self.profiles[(p+2):]
-        self.update('slice_tails')
+        self._run_selected('slice_tails', 'slice_tails')
 
     def slice_umbra(self):
-        p = self.selected_profile.get()
-        new_profile = self.profiles[p].slice_umbra()
-        self.profiles = self.profiles[:p] + [new_profile] + self.profiles[(p+1):]
-        self.update('slice_umbra')
+        self._run_selected('slice_umbra', 'slice_umbra')
 
     def on_key_press(self, event):
         print("you pressed {}".format(event.key))
         key_press_handler(event, self.canvas, self.toolbar)
 
     def _quit(self):
+        self.cancel()
+        self._worker.shutdown(wait=False)
         root.quit()
         root.destroy()
 
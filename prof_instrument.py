@@ -0,0 +1,197 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Opt-in timing and counters for Profile methods and importers.
+
+    Examples
+    --------
+    ``with prof_instrument.instrument() as stats:``
+    ``    profiles = profile_from.rfa_ascii(file_name)``
+    ``print(stats.table())``
+"""
+
+import json
+import time
+import inspect
+import functools
+import contextlib
+import tracemalloc
+
+from prof_funct import Profile
+import profile_from
+import cross_calibrate
+
+# pylint: disable = C0103, C0121, W0102
+
+# CHEAP DUNDERS, NOT WORTH RECORDING
+_SKIP = ('__len__', '__eq__', '__str__', '__copy__')
+
+
+class Stats():
+    """ per-operation counters
+
+    Attributes
+    ----------
+    ops : dict
+        {name: {'calls', 'seconds', 'points', 'bytes'}}, seconds
+        include time spent in nested instrumented calls
+
+    """
+
+    def __init__(self):
+        self.ops = {}
+
+    def record(self, name, seconds, points, num_bytes):
+        op = self.ops.setdefault(
+            name, {'calls': 0, 'seconds': 0.0, 'points': 0, 'bytes': 0})
+        op['calls'] += 1
+        op['seconds'] += seconds
+        op['points'] += points
+        op['bytes'] += num_bytes
+
+    def to_json(self, **kwargs):
+        """ counters as a JSON string """
+        return json.dumps(self.ops, **kwargs)
+
+    def table(self):
+        """ counters as a text table, slowest first """
+        fmt = '{:<36} {:>8} {:>10} {:>10} {:>12} {:>10}'
+        rows = [fmt.format('operation', 'calls', 'total s', 'mean ms',
+                           'points', 'alloc MB')]
+        for name, op in sorted(self.ops.items(), key=lambda i: -i[1]['seconds']):
+            rows.append(fmt.format(
+                name, op['calls'], '{:.4f}'.format(op['seconds']),
+                '{:.3f}'.format(1000 * op['seconds'] / op['calls']),
+                op['points'], '{:.2f}'.format(op['bytes'] / 1e6)))
+        return '\n'.join(rows)
+
+
+def _points(args, result):
+    """ points processed, from the Profile operated on or returned """
+    if args and isinstance(args[0], Profile):
+        return len(args[0])
+    if isinstance(result, Profile):
+        return len(result)
+    if isinstance(result, (list, tuple)):
+        return sum(len(r) for r in result if isinstance(r, Profile))
+    return 0
+
+
+def _wrap(func, name, stats, peaks):
+    """ func, recording to stats; peaks is the stack for nested calls """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if peaks is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            if peaks:
+                peaks[-1][1] = max(peaks[-1][1], peak)
+            peaks.append([current, current])
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            num_bytes = 0
+            if peaks is not None:
+                _, peak = tracemalloc.get_traced_memory()
+                start_current, seen = peaks.pop()
+                seen = max(seen, peak)
+                num_bytes = seen - start_current
+                if peaks:
+                    peaks[-1][1] = max(peaks[-1][1], seen)
+            stats.record(name, seconds, _points(args, result), num_bytes)
+        return result
+    return wrapper
+
+
+def _targets():
+    """ (owner, attribute, recorded name) for every instrumented callable """
+    for attr, value in vars(Profile).items():
+        if (inspect.isfunction(value) or isinstance(value, property)) and attr not in _SKIP:
+            yield Profile, attr, 'Profile.' + attr
+    for module in (profile_from, cross_calibrate):
+        for attr, value in vars(module).items():
+            if inspect.isfunction(value) and value.__module__ == module.__name__:
+                yield module, attr, module.__name__ + '.' + attr
+
+
+_active = []
+
+
+@contextlib.contextmanager
+def instrument(allocations=False):
+    """ record calls, time, points and memory within a with-block
+
+    Profile methods and profile_from and cross_calibrate functions are
+    wrapped on entry and restored on exit, so there is no overhead
+    outside the block. Calls made in worker processes are not seen.
+    Properties are recorded on every access, so Profile.interp times
+    building the interpolant on first use and little after.
+
+    Parameters
+    ----------
+    allocations : bool, optional
+        also record peak memory allocated per call, using tracemalloc,
+        which slows everything down considerably
+
+    Yields
+    ------
+    Stats
+
+    Raises
+    ------
+    RuntimeError
+        if already instrumenting
+
+    """
+    if _active:
+        raise RuntimeError('instrumentation is already active')
+    stats = Stats()
+    peaks = [] if allocations else None
+    started_tracing = allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    originals = []
+    for owner, attr, name in _targets():
+        original = vars(owner)[attr]
+        originals.append((owner, attr, original))
+        if isinstance(original, property):
+            setattr(owner, attr, property(_wrap(original.fget, name, stats, peaks),
+                                          original.fset, original.fdel, original.__doc__))
+        else:
+            setattr(owner, attr, _wrap(original, name, stats, peaks))
+    _active.append(stats)
+    try:
+        yield stats
+    finally:
+        for owner, attr, original in originals:
+            setattr(owner, attr, original)
+        _active.pop()
+        if started_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,226 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Sequential kernels of Profile, compiled by Numba when installed.
+
+    Each kernel is written twice: as a plain loop, which Numba compiles,
+    and in NumPy, used when Numba is missing. The backend is chosen on
+    import; set PROF_KERNELS=numpy beforehand to use NumPy regardless.
+
+    Examples
+    --------
+    ``prof_kernels.diagnostics()``
+    ``{'backend': 'numpy', 'numba': None, 'kernels': ['crossings', ...]}``
+"""
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _walk_loop(y, step):
+    """ indices where y has moved at least step since the last one kept """
+    keep = np.zeros(len(y), dtype=np.bool_)
+    last = y[0]
+    for i in range(len(y)):
+        if abs(y[i] - last) >= step:
+            keep[i] = True
+            last = y[i]
+    return np.nonzero(keep)[0]
+
+
+def _walk_numpy(y, step):
+    """ as _walk_loop, searching ahead in doubling windows """
+    keep = []
+    last, i, n = y[0], 0, len(y)
+    while i < n:
+        width = 64
+        while True:
+            hit = np.nonzero(np.abs(y[i:i+width] - last) >= step)[0]
+            if len(hit) or i + width >= n:
+                break
+            width *= 2
+        if not len(hit):
+            break
+        i += hit[0]
+        keep.append(i)
+        last = y[i]
+        i += 1
+    return np.array(keep, dtype=np.intp)
+
+
+def _crossings_loop(x, y, level):
+    """ distinct, non-zero x where y crosses or meets level, in order """
+    result = np.empty(len(x))
+    count = 0
+    for i in range(1, len(x)):
+        val = 0.0
+        if (y[i] - level) * (y[i-1] - level) < 0:
+            val = x[i] - ((y[i] - level) / (y[i] - y[i-1])) * (x[i] - x[i-1])
+        elif abs(y[i] - level) <= 1e-08 + 1e-05 * abs(level):  # np.isclose
+            val = x[i]
+        if val != 0.0:
+            seen = False
+            for j in range(count):
+                if result[j] == val:
+                    seen = True
+                    break
+            if not seen:
+                result[count] = val
+                count += 1
+    return result[:count]
+
+
+def _crossings_numpy(x, y, level):
+    """ as _crossings_loop, over all intervals at once """
+    between = (y[1:] - level) * (y[:-1] - level) < 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vals = x[1:] - ((y[1:] - level) / (y[1:] - y[:-1])) * (x[1:] - x[:-1])
+    vals = np.where(between, vals, np.where(np.isclose(y[1:], level), x[1:], 0.0))
+    vals = vals[vals != 0.0]
+    _, first = np.unique(vals, return_index=True)
+    return vals[np.sort(first)]
+
+
+def _scan_loop(fixed_x, fixed_y, x, y, offsets):
+    """ sum of fixed_y times (x, y) shifted by each offset at fixed_x
+
+    x ascending, linear interpolation, zero outside x.
+
+    """
+    n = len(x)
+    scores = np.zeros(len(offsets))
+    for k in range(len(offsets)):
+        total = 0.0
+        for i in range(len(fixed_x)):
+            t = fixed_x[i] - offsets[k]
+            if t < x[0] or t > x[n-1]:
+                continue
+            j = np.searchsorted(x, t, side='right') - 1
+            if j >= n - 1:
+                value = y[n-1]
+            else:
+                slope = (y[j+1] - y[j]) / (x[j+1] - x[j])
+                value = slope * (t - x[j]) + y[j]
+            total += fixed_y[i] * value
+        scores[k] = total
+    return scores
+
+
+def _scan_numpy(fixed_x, fixed_y, x, y, offsets):
+    """ as _scan_loop, one offset at a time """
+    scores = np.zeros(len(offsets))
+    for k, offset in enumerate(offsets):
+        t = fixed_x - offset
+        shifted = np.where((t < x[0]) | (t > x[-1]), 0.0, np.interp(t, x, y))
+        scores[k] = max(np.correlate(fixed_y, shifted))
+    return scores
+
+
+LOOPS = {'threshold_walk': _walk_loop, 'crossings': _crossings_loop,
+         'scan_offsets': _scan_loop}
+
+NUMPY = {'threshold_walk': _walk_numpy, 'crossings': _crossings_numpy,
+         'scan_offsets': _scan_numpy}
+
+if numba is not None and os.environ.get('PROF_KERNELS') != 'numpy':
+    BACKEND = 'numba'
+    KERNELS = {name: numba.njit(cache=True)(func) for name, func in LOOPS.items()}
+else:
+    BACKEND = 'numpy'
+    KERNELS = dict(NUMPY)
+
+
+def threshold_walk(y, step):
+    """ indices of y kept by Profile.resample_y, after the first
+
+    Parameters
+    ----------
+    y : np.array
+    step : float
+
+    Returns
+    -------
+    np.array of int
+
+    """
+    return KERNELS['threshold_walk'](np.asarray(y, dtype=float), float(step))
+
+
+def crossings(x, y, level):
+    """ x-values at which y crosses level, as Profile.get_x
+
+    Parameters
+    ----------
+    x, y : np.array
+    level : float
+
+    Returns
+    -------
+    np.array
+
+    """
+    return KERNELS['crossings'](np.asarray(x, dtype=float),
+                                np.asarray(y, dtype=float), float(level))
+
+
+def scan_offsets(fixed_x, fixed_y, x, y, offsets):
+    """ correlation of fixed with (x, y) at each offset, as Profile.align_to
+
+    Parameters
+    ----------
+    fixed_x, fixed_y : np.array
+    x, y : np.array
+        x ascending
+    offsets : np.array
+
+    Returns
+    -------
+    np.array
+
+    """
+    return KERNELS['scan_offsets'](*(np.asarray(a, dtype=float) for a in
+                                     (fixed_x, fixed_y, x, y, offsets)))
+
+
+def diagnostics():
+    """ backend in use
+
+    Returns
+    -------
+    dict
+        backend, Numba version or None, and kernel names
+
+    """
+    return {'backend': BACKEND,
+            'numba': numba.__version__ if numba is not None else None,
+            'kernels': sorted(KERNELS)}
@@ -0,0 +1,183 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Deferred chains of Profile transforms, evaluated in one pass.
+
+    Examples
+    --------
+    ``p = prof_lazy.lazy(profile).make_centered().make_normal_y()``
+    ``p = p.resample_x(0.1).slice_segment(-5, 5).compute()``
+
+    gives the same data as the eager
+    ``profile.make_centered().make_normal_y().resample_x(0.1).slice_segment(-5, 5)``
+    without building an intermediate Profile or interpolator at each
+    step, and interpolating only the resampled points the slice keeps.
+"""
+
+import numpy as np
+
+import prof_funct
+from prof_funct import Profile, resample_grid
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _interp(x_new, x, y):
+    """ linear interpolation, zero outside x, as Profile.interp """
+    order = np.argsort(x, kind='mergesort')
+    x, y = x[order], y[order]
+    result = np.interp(x_new, x, y)
+    return np.where((x_new < x[0]) | (x_new > x[-1]), 0.0, result)
+
+
+class Lazy():
+    """ recorded Profile transforms, applied by compute()
+
+    Each method returns a new Lazy, leaving this one unchanged.
+
+    Attributes
+    ----------
+    profile : Profile
+        source, never modified
+    ops : tuple
+        (name, args) in order
+
+    """
+
+    def __init__(self, profile, ops=()):
+        self.profile = profile
+        self.ops = ops
+
+    def _then(self, name, *args):
+        return Lazy(self.profile, self.ops + ((name, args),))
+
+    def __add__(self, other):
+        """ shift right """
+        return self._then('shift', other)
+
+    def __sub__(self, other):
+        """ shift left """
+        return self._then('shift', -other)
+
+    def __mul__(self, other):
+        """ scale y """
+        return self._then('scale', other)
+
+    def make_flipped(self):
+        return self._then('flip')
+
+    def make_centered(self):
+        return self._then('center')
+
+    def make_normal_y(self, x=0.0, y=1.0):
+        return self._then('normal_y', x, y)
+
+    def slice_segment(self, start=-np.inf, stop=np.inf):
+        return self._then('slice', start, stop)
+
+    def resample_x(self, step=None, begin=None, end=None, num_points=None):
+        return self._then('resample', step, begin, end, num_points)
+
+    def compute(self):
+        """ the transformed Profile
+
+        Shifts, scalings, flips and normalisations act directly on the
+        arrays. A resample is held back until another operation needs
+        its values, so that any slices that follow narrow its grid first
+        and only the kept points are interpolated.
+
+        The arrays are carried in float64 and cast once at the end, to
+        the prof_funct.precision policy if set, else to the dtypes x and
+        y were stored in, so a float32 result is rounded once rather than
+        after every step as the eager methods would. Profiles with other
+        than linear interpolation, or not stored as floats, are
+        transformed step by step by the eager methods.
+
+        Returns
+        -------
+        Profile
+
+        """
+        if (self.profile.kind != 'linear' or
+                not np.issubdtype(self.profile.x.dtype, np.floating) or
+                not np.issubdtype(self.profile.y.dtype, np.floating)):
+            return self._eager()
+        x_dtype, y_dtype = self.profile.x.dtype, self.profile.y.dtype
+        x = np.array(self.profile.x, dtype=float)
+        y = np.array(self.profile.y, dtype=float)
+        meta = self.profile.meta
+        grid = None  # PENDING RESAMPLE
+
+        for name, args in self.ops:
+            if name == 'slice' and grid is not None:
+                grid = grid[np.logical_and(grid >= args[0], grid <= args[1])]
+                meta = {}
+                continue
+            if grid is not None:
+                x, y, grid = grid, _interp(grid, x, y), None
+
+            if name == 'shift':
+                x = x + args[0]
+            elif name == 'scale':
+                y = y * args[0]
+            elif name == 'flip':
+                y = y[::-1]
+            elif name == 'center':
+                dydx = np.gradient(y, x)
+                x = x - np.average((x[np.argmax(dydx)], x[np.argmin(dydx)]))
+            elif name == 'normal_y':
+                y = (args[1] / _interp(np.array(args[0]), x, y)) * y
+            elif name == 'slice':
+                keep = np.logical_and(x >= args[0], x <= args[1])
+                x, y = x[keep], _interp(x[keep], x, y)
+                meta = {}
+            elif name == 'resample':
+                grid = resample_grid(x, *args)
+
+        if grid is not None:
+            x, y = grid, _interp(grid, x, y)
+        if prof_funct._precision is None:  # ELSE CAST BY Profile
+            x, y = x.astype(x_dtype), y.astype(y_dtype)
+        return Profile(x, y, meta)
+
+    def _eager(self):
+        """ ops applied by the Profile methods """
+        result = self.profile
+        for name, args in self.ops:
+            if name == 'shift':
+                result = result + args[0]
+            elif name == 'scale':
+                result = result * args[0]
+            else:
+                method = {'flip': 'make_flipped', 'center': 'make_centered',
+                          'normal_y': 'make_normal_y', 'slice': 'slice_segment',
+                          'resample': 'resample_x'}[name]
+                result = getattr(result, method)(*args)
+        return result
+
+
+def lazy(profile):
+    """ deferred transforms of profile """
+    return Lazy(profile)
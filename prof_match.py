@@ -0,0 +1,148 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Pair measured profiles with their planning system counterparts.
+
+    Examples
+    --------
+    ``catalog = prof_catalog.Catalog()``
+    ``catalog.add_folder('/shared/commissioning')``
+    ``pairs, lone_measured, lone_planned = prof_match.match(``
+    ``    catalog.query(source='rfa'), catalog.query(source='pinnacle'))``
+    ``rows = list(prof_match.compare(pairs))``
+"""
+
+import bisect
+
+import prof_batch
+
+# pylint: disable = C0103, C0121, W0102
+
+# KEYS OF prof_catalog.normalise
+# source IS NOT COMPARED, MEASURED AND PLANNED DIFFER BY DEFINITION
+EXACT_KEYS = ('direction', 'wedge')
+NUMERIC_KEYS = ('depth', 'energy', 'field_x', 'field_y', 'ssd', 'offset')
+
+# GREATEST DIFFERENCE IN EACH NUMERIC KEY, CM AND MV
+TOLERANCES = {'depth': 0.05, 'energy': 0.05, 'field_x': 0.05, 'field_y': 0.05,
+              'ssd': 0.5, 'offset': 0.05}
+
+
+def _group(meta, exact, numeric):
+    """ hash key: exact values, and which numeric values are missing """
+    return tuple(meta.get(k) for k in exact) + \
+        tuple(meta.get(k) is None for k in numeric)
+
+
+def match(measured, planned, tol={}, exact=EXACT_KEYS, numeric=NUMERIC_KEYS):
+    """ best planned counterpart for each measured profile
+
+    Candidates are found by hashing on the exact keys, then bisecting
+    on the first numeric key within each group, so n items are matched
+    in O(n log n) rather than by comparing every pair. A missing value
+    only matches a missing value.
+
+    Pairing is many-to-one: each measured profile takes its closest
+    planned profile, which repeat measurements of one field may share.
+
+    Parameters
+    ----------
+    measured, planned : list
+        of prof_catalog.ProfileHandle, or anything with a normalised
+        meta dict
+    tol : dict, optional
+        greatest difference allowed by numeric key, overriding TOLERANCES
+    exact : tuple of str, optional
+        keys that must be equal
+    numeric : tuple of str, optional
+        keys that must agree within their tolerance, the first used for
+        sorting
+
+    Returns
+    -------
+    tuple
+        (list of (measured, planned), unmatched measured, unmatched planned),
+        where the closest planned item is chosen, by summed difference
+
+    """
+    tol = dict(TOLERANCES, **tol)
+    groups = {}
+    for item in planned:
+        groups.setdefault(_group(item.meta, exact, numeric), []).append(item)
+    indices = {}
+    for key, items in groups.items():
+        if numeric and items[0].meta.get(numeric[0]) is not None:
+            items.sort(key=lambda i: i.meta[numeric[0]])
+            indices[key] = (items, [i.meta[numeric[0]] for i in items])
+        else:
+            indices[key] = (items, None)
+
+    pairs, lone_measured, used = [], [], set()
+    for item in measured:
+        key = _group(item.meta, exact, numeric)
+        if key not in indices:
+            lone_measured.append(item)
+            continue
+        items, sorted_values = indices[key]
+        if sorted_values is not None:
+            value = item.meta[numeric[0]]
+            items = items[bisect.bisect_left(sorted_values, value - tol[numeric[0]]):
+                          bisect.bisect_right(sorted_values, value + tol[numeric[0]])]
+        best, best_diff = None, None
+        for candidate in items:
+            diffs = {k: abs(item.meta[k] - candidate.meta[k]) for k in numeric
+                     if item.meta.get(k) is not None}
+            if all(d <= tol[k] for k, d in diffs.items()) and \
+               (best is None or sum(diffs.values()) < best_diff):
+                best, best_diff = candidate, sum(diffs.values())
+        if best is None:
+            lone_measured.append(item)
+        else:
+            pairs.append((item, best))
+            used.add(id(best))
+    lone_planned = [item for item in planned if id(item) not in used]
+    return pairs, lone_measured, lone_planned
+
+
+def compare(pairs, analyses=['gamma']):
+    """ analyses of each measured profile against its planned counterpart
+
+    Parameters
+    ----------
+    pairs : list of (ProfileHandle, ProfileHandle)
+        as returned by match
+    analyses : list of str, optional
+        keys of prof_batch.ANALYSES, the planned profile is the reference
+
+    Yields
+    ------
+    dict
+
+    """
+    for measured, planned in pairs:
+        row = {'measured_file': measured.file, 'measured_index': measured.index,
+               'planned_file': planned.file, 'planned_index': planned.index}
+        row.update(prof_batch.analyse(measured.load(), analyses, planned.load()))
+        yield row
@@ -0,0 +1,136 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Flatness and symmetry under several protocols, in one pass.
+
+    Examples
+    --------
+    ``result = prof_metrics.metrics(profiles, flatness=['range', 'varian'],``
+    ``                              symmetry=['area'], regions=[0.8, 0.9])``
+    ``result['flatness_varian_80']``
+"""
+
+import numpy as np
+from scipy.integrate import trapezoid
+
+from prof_funct import Profile
+
+# pylint: disable = C0103, C0121, W0102
+
+
+def _flat_range(x, dose):
+    """ dose range relative to mean, as Profile.get_flatness """
+    return (max(dose) - min(dose)) / np.average(dose)
+
+
+def _flat_varian(x, dose):
+    """ (max - min) / (max + min) """
+    return (max(dose) - min(dose)) / (max(dose) + min(dose))
+
+
+def _flat_iec(x, dose):
+    """ max / min """
+    return max(dose) / min(dose)
+
+
+def _sym_point_difference(x, dose):
+    """ max point difference relative to mean, as Profile.get_symmetry """
+    return max(np.abs(np.subtract(dose, dose[::-1]) / np.average(dose)))
+
+
+def _sym_point_ratio(x, dose):
+    """ max ratio of opposite points """
+    return max(dose / dose[::-1])
+
+
+def _sym_area(x, dose):
+    """ difference of areas either side of centre, relative to their sum """
+    centre = 0.5 * (x[0] + x[-1])
+    left, right = x <= centre, x >= centre
+    lt_area = trapezoid(dose[left], x[left])
+    rt_area = trapezoid(dose[right], x[right])
+    return (lt_area - rt_area) / (lt_area + rt_area)
+
+
+FLATNESS = {'range': _flat_range, 'varian': _flat_varian, 'iec': _flat_iec}
+
+SYMMETRY = {'point_difference': _sym_point_difference,
+            'point_ratio': _sym_point_ratio, 'area': _sym_area}
+
+
+def names(flatness=['range'], symmetry=['point_difference'], regions=[0.8]):
+    """ result field names, e.g. 'flatness_range_80' """
+    result = ['edge_left', 'edge_right']
+    for region in regions:
+        result += ['flatness_{}_{:g}'.format(f, 100 * region) for f in flatness]
+        result += ['symmetry_{}_{:g}'.format(s, 100 * region) for s in symmetry]
+    return result
+
+
+def metrics(profiles, flatness=['range'], symmetry=['point_difference'],
+            regions=[0.8]):
+    """ flatness and symmetry definitions from one edge analysis
+
+    The edges of each profile are found once and every region is sliced
+    from them as Profile.slice_umbra does, so 'range' and
+    'point_difference' over 0.8 match get_flatness and get_symmetry.
+
+    Parameters
+    ----------
+    profiles : Profile or list of Profile
+    flatness : list of str, optional
+        keys of FLATNESS
+    symmetry : list of str, optional
+        keys of SYMMETRY
+    regions : list of float, optional
+        fractions of the distance to each edge, e.g. 0.8 and 0.9
+
+    Returns
+    -------
+    np.recarray
+        one record per profile, fields as from names()
+
+    Raises
+    ------
+    KeyError
+        for an unknown definition
+
+    """
+    if isinstance(profiles, Profile):
+        profiles = [profiles]
+    funcs = [FLATNESS[f] for f in flatness] + [SYMMETRY[s] for s in symmetry]
+    fields = names(flatness, symmetry, regions)
+    result = np.recarray(len(profiles), dtype=[(f, float) for f in fields])
+    for i, profile in enumerate(profiles):
+        x = np.asarray(profile.x, dtype=float)  # ACCUMULATE IN DOUBLE
+        y = np.asarray(profile.y, dtype=float)
+        lt, rt = profile.get_edges()
+        row = [lt, rt]
+        for region in regions:
+            idx = np.nonzero((x >= region * lt) & (x <= region * rt))[0]
+            seg = slice(idx[0], idx[-1] + 1)
+            row += [func(x[seg], y[seg]) for func in funcs]
+        result[i] = tuple(row)
+    return result
@@ -0,0 +1,164 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Depth-dose analysis, for many curves at once.
+
+    A depth-dose curve is a Profile with depth in cm as x, as imported
+    from Pinnacle ``De`` profiles, or an RFA depth scan, whose x is
+    centred by the importer and so is taken from its start point.
+
+    Examples
+    --------
+    ``pdds = [p for p in profile_from.pinnacle_ascii(file_name)``
+    ``        if p.meta['type'].startswith('De')]``
+    ``result = prof_pdd.metrics(pdds)``
+    ``result['r50']``
+"""
+
+import numpy as np
+
+# pylint: disable = C0103, C0121, W0102
+
+METRICS = ('dmax', 'r80', 'r50', 'd10', 'd20', 'surface')
+
+
+def depths(profile):
+    """ depth in cm of each point of a depth-dose curve
+
+    x, unless profile is an RFA depth scan, with start and end points
+    in mm differing only in depth, when it is the distance along the
+    scan from the start point.
+
+    """
+    x = np.asarray(profile.x)
+    start, end = profile.meta.get('start_pt'), profile.meta.get('end_pt')
+    if start is None or end is None:
+        return x
+    start = [float(v) for v in start]
+    end = [float(v) for v in end]
+    if start[:2] != end[:2] or start[2] == end[2]:
+        return x
+    return start[2] / 10 + np.sign(end[2] - start[2]) * (x - x[0])
+
+
+def stack(profiles):
+    """ depths and doses of each curve as rows, sorted by depth
+
+    Returns
+    -------
+    tuple
+        (x, y) arrays of shape (curves, most points), padded with nan,
+        float32 if every curve is
+
+    """
+    width = max(len(p) for p in profiles)
+    dtype = np.result_type(np.float32, *(p.y.dtype for p in profiles))
+    x = np.full((len(profiles), width), np.nan, dtype=dtype)
+    y = np.full((len(profiles), width), np.nan, dtype=dtype)
+    for i, profile in enumerate(profiles):
+        depth = depths(profile)
+        order = np.argsort(depth)
+        x[i, :len(profile)] = depth[order]
+        y[i, :len(profile)] = np.asarray(profile.y)[order]
+    return x, y
+
+
+def _between(x, y, j, level):
+    """ x where y crosses level between columns j-1 and j of each row """
+    rows = np.arange(len(x))
+    x0, x1 = x[rows, j - 1], x[rows, j]
+    y0, y1 = y[rows, j - 1], y[rows, j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(y1 == y0, x0, x0 + (level - y0) * (x1 - x0) / (y1 - y0))
+
+
+def range_at(x, y, level):
+    """ depth beyond dmax where each curve first falls below level
+
+    Parameters
+    ----------
+    x, y : np.array
+        as from stack, y in percent of maximum
+    level : float
+        percent
+
+    Returns
+    -------
+    np.array
+        nan where a curve does not fall that far
+
+    """
+    peak = np.nanargmax(y, axis=1)
+    below = (y < level) & (np.arange(x.shape[1]) > peak[:, None])
+    j = np.argmax(below, axis=1)
+    result = _between(x, y, np.maximum(j, 1), level)
+    return np.where(below.any(axis=1), result, np.nan)
+
+
+def dose_at(x, y, depth):
+    """ dose of each curve at depth, nan outside the measured depths """
+    j = np.sum(x < depth, axis=1)
+    inside = (j > 0) & (j < np.sum(~np.isnan(x), axis=1)) | (x[:, 0] == depth)
+    j = np.clip(j, 1, x.shape[1] - 1)
+    rows = np.arange(len(x))
+    x0, x1 = x[rows, j - 1], x[rows, j]
+    y0, y1 = y[rows, j - 1], y[rows, j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.where(x1 == x0, y0, y0 + (depth - x0) * (y1 - y0) / (x1 - x0))
+    result = np.where(x[:, 0] == depth, y[:, 0], result)
+    return np.where(inside, result, np.nan)
+
+
+def metrics(profiles):
+    """ depth-dose metrics for each curve
+
+    Each curve is normalised to its own maximum. Crossings are found
+    over the whole stacked array and linearly interpolated between
+    the neighbouring points.
+
+    Parameters
+    ----------
+    profiles : list of Profile
+        depth-dose curves, x in cm
+
+    Returns
+    -------
+    dict
+        {metric: np.array with one value per curve}, where
+        dmax, r80, r50 are depths in cm, d10 and d20 are percent dose
+        at 10 and 20 cm, and surface is percent dose at the shallowest
+        measured depth
+
+    """
+    x, y = stack(profiles)
+    y = 100 * y / np.nanmax(y, axis=1)[:, None]
+    return {
+        'dmax': x[np.arange(len(x)), np.nanargmax(y, axis=1)],
+        'r80': range_at(x, y, 80.0),
+        'r50': range_at(x, y, 50.0),
+        'd10': dose_at(x, y, 10.0),
+        'd20': dose_at(x, y, 20.0),
+        'surface': y[:, 0],
+    }
@@ -0,0 +1,282 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Dose planes, and their registration to one another.
+
+    Examples
+    --------
+    ``film = prof_plane.from_png('film.png')``
+    ``planned = prof_plane.from_matrix('plane.txt')``
+    ``aligned, transform = prof_plane.register(film, planned, max_angle=3)``
+    ``aligned.get_profile('x')``
+"""
+
+import numpy as np
+import PIL
+import matplotlib.image as mpimg
+from scipy import fft, interpolate, ndimage
+
+from prof_funct import Profile
+from prof_align import parabola
+
+# pylint: disable = C0103, C0121, W0102
+
+
+class Plane():
+    """ dose over a rectangular grid
+
+    Attributes
+    ----------
+    x : np.array
+        column distances in cm, ascending
+    y : np.array
+        row distances in cm, ascending
+    dose : np.array
+        of shape (len(y), len(x))
+    meta : dict
+
+    """
+
+    def __init__(self, x, y, dose, meta={}):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        dose = np.asarray(dose, dtype=float)
+        if dose.shape != (len(y), len(x)):
+            raise ValueError('dose must have shape (len(y), len(x)).')
+        cols = np.argsort(x, kind='mergesort')
+        rows = np.argsort(y, kind='mergesort')
+        self.x, self.y = x[cols], y[rows]
+        self.dose = dose[np.ix_(rows, cols)]
+        self.meta = meta
+
+    def __repr__(self):
+        return 'Plane({} x {})'.format(len(self.x), len(self.y))
+
+    def get_increment(self):
+        """ (x, y) minimum step-size increments """
+        return np.min(np.diff(self.x)), np.min(np.diff(self.y))
+
+    def get_dose(self, x, y):
+        """ dose at distances, interpolated linearly, zero outside
+
+        Parameters
+        ----------
+        x, y : float or np.array
+            broadcast together
+
+        Returns
+        -------
+        np.array
+
+        """
+        interp = interpolate.RegularGridInterpolator(
+            (self.y, self.x), self.dose, bounds_error=False, fill_value=0.0)
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        return interp(np.stack([y, x], axis=-1))
+
+    def resample(self, x, y):
+        """ plane on the grid of x and y
+
+        Returns
+        -------
+        Plane
+
+        """
+        grid_x, grid_y = np.meshgrid(x, y)
+        return Plane(x, y, self.get_dose(grid_x, grid_y), self.meta)
+
+    def get_profile(self, direction='x', offset=0.0):
+        """ line through the plane, parallel to an axis
+
+        Parameters
+        ----------
+        direction : str, optional
+            'x' or 'y'
+        offset : float, optional
+            distance of the line from the other axis, in cm
+
+        Returns
+        -------
+        Profile
+
+        """
+        meta = dict(self.meta, direction=direction, offset=offset)
+        if direction == 'x':
+            return Profile(x=self.x, y=self.get_dose(self.x, offset), meta=meta)
+        if direction == 'y':
+            return Profile(x=self.y, y=self.get_dose(offset, self.y), meta=meta)
+        raise ValueError("direction must be 'x' or 'y'.")
+
+
+def from_png(file_name, step_size=0.1):
+    """ import a full film scan from png file
+
+    Channels are averaged, as in profile_from.narrow_png, and pixels are
+    averaged in square blocks to the step size. Zero distance is at the
+    centre of the image.
+
+    Parameters
+    ----------
+    file_name : str
+    step_size : float, optional
+        cm, at least the pixel size
+
+    Returns
+    -------
+    Plane
+
+    """
+    dpi_horiz, dpi_vert = PIL.Image.open(file_name).info['dpi']
+    image = mpimg.imread(file_name)
+    if image.ndim == 3:
+        image = np.mean(image, axis=2, dtype=float)
+    pixel_x, pixel_y = 2.54 / dpi_horiz, 2.54 / dpi_vert
+
+    block_x = min(max(int(step_size / pixel_x), 1), image.shape[1])
+    block_y = min(max(int(step_size / pixel_y), 1), image.shape[0])
+    rows, cols = image.shape[0] // block_y, image.shape[1] // block_x
+    dose = image[:rows*block_y, :cols*block_x].reshape(
+        rows, block_y, cols, block_x).mean(axis=(1, 3), dtype=float)
+
+    x = (np.arange(cols) - (cols - 1) / 2) * block_x * pixel_x
+    y = (np.arange(rows) - (rows - 1) / 2) * block_y * pixel_y
+    return Plane(x, y, dose, {'file': file_name})
+
+
+def from_matrix(file_name, delimiter=None):
+    """ import a planned dose plane from a text matrix
+
+    The first row holds the x distances, each following row its y
+    distance then a dose for each x. The corner value is ignored.
+    This is the layout of tab, comma or space separated dose plane
+    exports.
+
+    Parameters
+    ----------
+    file_name : str
+    delimiter : str, optional
+        any whitespace by default
+
+    Returns
+    -------
+    Plane
+
+    """
+    data = np.loadtxt(file_name, delimiter=delimiter, ndmin=2)
+    return Plane(data[0, 1:], data[1:, 0], data[1:, 1:], {'file': file_name})
+
+
+def _phase_correlation(fixed, moving):
+    """ surface peaking at the shift, in pixels, that takes moving onto fixed """
+    shape = [fft.next_fast_len(a + b) for a, b in zip(fixed.shape, moving.shape)]
+    cross = fft.rfft2(fixed, shape) * np.conj(fft.rfft2(moving, shape))
+    magnitude = np.abs(cross)
+    cross /= magnitude + 1e-12 * magnitude.max()  # KEEP THE PHASE ONLY
+    return fft.irfft2(cross, shape)
+
+
+def _peak(surface, fixed_shape):
+    """ (rows, cols, height) of the highest point, refined between pixels """
+    i, j = np.unravel_index(np.argmax(surface), surface.shape)
+    n, m = surface.shape
+    rows = parabola(surface[i-1, j], surface[i, j], surface[(i+1) % n, j])
+    cols = parabola(surface[i, j-1], surface[i, j], surface[i, (j+1) % m])
+    rows += i - n if i >= fixed_shape[0] else i  # WRAPPED TO NEGATIVE
+    cols += j - m if j >= fixed_shape[1] else j
+    return rows, cols, surface[i, j]
+
+
+def _oriented(dose, flip_x, flip_y, angle):
+    """ dose flipped, then rotated degrees about its centre """
+    dose = dose[::-1 if flip_y else 1, ::-1 if flip_x else 1]
+    if angle:
+        dose = ndimage.rotate(dose, angle, reshape=False, order=1)
+    return dose
+
+
+def register(moving, fixed, flips=True, max_angle=0.0, angle_step=0.5):
+    """ moving aligned to fixed, by phase correlation
+
+    Both planes are resampled to square pixels the size of the smallest
+    step of fixed. The phase correlation of each flip, and each trial
+    rotation, with fixed gives a shift from the position of its peak,
+    refined between pixels by a parabola, and a score from its height.
+    The best rotation is likewise refined between trial angles.
+
+    Parameters
+    ----------
+    moving, fixed : Plane
+        e.g. a film scan and a planned dose plane
+    flips : bool, optional
+        also try moving mirrored in x, in y, and in both
+    max_angle : float, optional
+        greatest rotation tried either way, in degrees, 0 for none
+    angle_step : float, optional
+        degrees between trial rotations
+
+    Returns
+    -------
+    tuple
+        (Plane on the grid of fixed, dict of transform), where moving is
+        flipped about its centre, rotated by 'angle' degrees about its
+        centre and then shifted by 'dx' and 'dy' in cm
+
+    """
+    step = min(fixed.get_increment())
+    fixed_x = np.arange(fixed.x[0], fixed.x[-1] + 0.5*step, step)
+    fixed_y = np.arange(fixed.y[0], fixed.y[-1] + 0.5*step, step)
+    target = fixed.resample(fixed_x, fixed_y).dose
+    moving_x = np.arange(moving.x[0], moving.x[-1] + 0.5*step, step)
+    moving_y = np.arange(moving.y[0], moving.y[-1] + 0.5*step, step)
+    source = moving.resample(moving_x, moving_y).dose
+
+    angles = np.arange(-max_angle, max_angle + 0.5*angle_step, angle_step) \
+        if max_angle else np.zeros(1)
+    orientations = [(False, False), (True, False), (False, True), (True, True)] \
+        if flips else [(False, False)]
+
+    best = None
+    for flip_x, flip_y in orientations:
+        heights = [_peak(_phase_correlation(target, _oriented(source, flip_x, flip_y, a)),
+                         target.shape)[2] for a in angles]
+        k = int(np.argmax(heights))
+        angle = angles[k]
+        if 0 < k < len(angles) - 1:
+            angle += angle_step * parabola(*heights[k-1:k+2])
+        oriented = _oriented(source, flip_x, flip_y, angle)
+        rows, cols, height = _peak(_phase_correlation(target, oriented), target.shape)
+        if best is None or height > best[0]:
+            best = (height, flip_x, flip_y, angle, rows, cols, oriented)
+
+    height, flip_x, flip_y, angle, rows, cols, oriented = best
+    dx = fixed_x[0] - moving_x[0] + cols * step
+    dy = fixed_y[0] - moving_y[0] + rows * step
+
+    grid_x, grid_y = np.meshgrid(fixed.x, fixed.y)
+    coords = [(grid_y - dy - moving_y[0]) / step, (grid_x - dx - moving_x[0]) / step]
+    dose = ndimage.map_coordinates(oriented, coords, order=1, cval=0.0)
+    transform = {'dx': float(dx), 'dy': float(dy), 'angle': float(angle), 'flip_x': flip_x,
+                 'flip_y': flip_y, 'score': float(height)}
+    return Plane(fixed.x, fixed.y, dose, dict(moving.meta)), transform
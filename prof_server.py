@@ -0,0 +1,346 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Local HTTP analysis service with a warm worker pool.
+
+    Usage
+    -----
+    ``python prof_server.py --port 8050 --workers 4``
+
+    ``GET  /analyse?path=/data/scan.asc&analyses=edges,flatness``
+    ``POST /analyse?name=scan.asc&analyses=edges`` with the file as body
+    ``GET  /metrics``
+
+    Optional query keys for /analyse: ``reference`` (local path) and
+    ``reference_index``, for gamma.
+
+    Imported profiles are cached in each worker process, so with several
+    workers a repeated request hits the cache only when it reaches a
+    worker that has served it before.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+import collections
+import http.server
+import urllib.parse
+import concurrent.futures
+
+import profile_from
+import prof_batch
+import prof_funct
+
+# pylint: disable = C0103, C0121, W0102
+
+CACHE_SIZE = 32
+
+_cache = collections.OrderedDict()  # PER WORKER PROCESS
+
+
+class Unreadable(Exception):
+    """ file or upload could not be imported """
+
+
+def _load(name, stamp, data=None):
+    """ profiles from a local file or uploaded bytes, cached
+
+    Parameters
+    ----------
+    name : str
+        path, or upload file name for its extension
+    stamp : tuple or str
+        (mtime, size) of a path, or digest of uploaded data
+    data : bytes, optional
+
+    Returns
+    -------
+    tuple
+        (list of Profile, cache hit)
+
+    Raises
+    ------
+    Unreadable
+        if the importer fails, e.g. for an unknown extension
+
+    """
+    key = (name, stamp)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key], True
+    try:
+        if data is None:
+            profiles = profile_from.from_file(name)
+        else:  # IMPORTERS READ FILES
+            suffix = os.path.splitext(name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as upload:
+                upload.write(data)
+            try:
+                profiles = profile_from.from_file(upload.name)
+            finally:
+                os.remove(upload.name)
+    except Exception as error:  # pylint: disable = W0703
+        raise Unreadable('{}: {}'.format(type(error).__name__, error)) from error
+    _cache[key] = profiles
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return profiles, False
+
+
+def _analyse(source, analyses, reference=None):
+    """ worker task: rows for each profile in source
+
+    Parameters
+    ----------
+    source : tuple
+        (name, stamp, data) as for _load
+    analyses : list of str
+    reference : tuple, optional
+        (name, stamp, index)
+
+    Returns
+    -------
+    tuple
+        (rows, cache hit)
+
+    """
+    profiles, hit = _load(*source)
+    if reference:
+        reference = _load(reference[0], reference[1])[0][reference[2]]
+    rows = []
+    for index, profile in enumerate(profiles):
+        row = {'file': source[0], 'index': index}
+        row.update(prof_batch.analyse(profile, analyses, reference))
+        rows.append(row)
+    return rows, hit
+
+
+def _warm():
+    """ no-op task
+
+    Importing this module in the worker has already loaded numpy, scipy
+    and the importers, so submitting _warm starts a worker ready to go.
+
+    """
+    return None
+
+
+class Busy(Exception):
+    """ queue is full """
+
+
+class Service():
+    """ worker pool with a bounded queue
+
+    Attributes
+    ----------
+    workers : int
+    max_queue : int
+        requests allowed to wait beyond those running
+    root : str
+        local paths must be inside root, if given
+
+    """
+
+    def __init__(self, workers=None, max_queue=16, root=None):
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=prof_funct.set_precision,
+            initargs=(prof_funct._precision,))
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.root = os.path.realpath(root) if root else None
+        self.lock = threading.Lock()
+        self.counts = {'in_flight': 0, 'completed': 0, 'failed': 0,
+                       'rejected': 0, 'cache_hits': 0}
+        concurrent.futures.wait([self.pool.submit(_warm)
+                                 for _ in range(self.workers)])
+
+    def local(self, path):
+        """ (path, stamp) for a local file
+
+        Raises
+        ------
+        PermissionError
+            if outside root
+        FileNotFoundError
+
+        """
+        path = os.path.realpath(path)
+        if self.root and os.path.commonpath([self.root, path]) != self.root:
+            raise PermissionError(path)
+        stat = os.stat(path)
+        return path, (stat.st_mtime_ns, stat.st_size)
+
+    def analyse(self, source, analyses, reference=None):
+        """ rows for source, run on the pool
+
+        Raises
+        ------
+        Busy
+            if workers + max_queue requests are already in flight
+
+        """
+        with self.lock:
+            if self.counts['in_flight'] >= self.workers + self.max_queue:
+                self.counts['rejected'] += 1
+                raise Busy()
+            self.counts['in_flight'] += 1
+        try:
+            rows, hit = self.pool.submit(_analyse, source, analyses, reference).result()
+        except Exception:
+            with self.lock:
+                self.counts['failed'] += 1
+            raise
+        finally:
+            with self.lock:
+                self.counts['in_flight'] -= 1
+        with self.lock:
+            self.counts['completed'] += 1
+            self.counts['cache_hits'] += hit
+        return rows
+
+    def metrics(self):
+        with self.lock:
+            result = dict(self.counts)
+        result['queue_depth'] = max(0, result['in_flight'] - self.workers)
+        result['workers'] = self.workers
+        result['max_queue'] = self.max_queue
+        return result
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ routes /analyse and /metrics to the service """
+
+    service = None
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _query(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        return url.path, query
+
+    def _analyse(self, source, query):
+        analyses = query.get('analyses')
+        analyses = analyses.split(',') if analyses else list(prof_batch.DEFAULT_ANALYSES)
+        unknown = [a for a in analyses if a not in prof_batch.ANALYSES]
+        if unknown:
+            return self._reply(400, {'error': 'unknown analyses: ' + ','.join(unknown)})
+        if source is None and 'path' not in query:
+            return self._reply(400, {'error': 'path or upload required'})
+        try:
+            reference = None
+            if 'reference' in query:
+                reference = self.service.local(query['reference']) + \
+                    (int(query.get('reference_index', 0)),)
+                if 'gamma' not in analyses:
+                    analyses.append('gamma')
+            if source is None:
+                source = self.service.local(query['path']) + (None,)
+            rows = self.service.analyse(source, analyses, reference)
+        except PermissionError as error:
+            return self._reply(403, {'error': 'outside root: {}'.format(error)})
+        except FileNotFoundError as error:
+            return self._reply(404, {'error': str(error)})
+        except Unreadable as error:
+            return self._reply(400, {'error': 'unreadable: {}'.format(error)})
+        except Busy:
+            return self._reply(503, {'error': 'busy'})
+        except Exception as error:  # pylint: disable = W0703
+            return self._reply(500, {'error': str(error)})
+        return self._reply(200, rows)
+
+    def do_GET(self):
+        path, query = self._query()
+        if path == '/metrics':
+            return self._reply(200, self.service.metrics())
+        if path == '/analyse':
+            return self._analyse(None, query)
+        return self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path, query = self._query()
+        if path != '/analyse':
+            return self._reply(404, {'error': 'not found'})
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        name = os.path.basename(query.get('name', 'upload'))
+        source = (name, hashlib.sha1(data).hexdigest(), data)
+        return self._analyse(source, query)
+
+    def log_message(self, *args):  # QUIET
+        pass
+
+
+def serve(port=8050, workers=None, max_queue=16, root=None):
+    """ HTTP server bound to localhost only
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        with a ``service`` attribute, not yet serving
+
+    """
+    service = Service(workers, max_queue, root)
+    handler = type('BoundHandler', (Handler,), {'service': service})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-queue', type=int, default=16)
+    parser.add_argument('--root', help='only serve local paths under root')
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.workers, args.max_queue, args.root)
+    print('serving on http://127.0.0.1:{}'.format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
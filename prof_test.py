@@ -28,9 +28,24 @@ import os
 import numpy as np
 import sys
 
+import prof_funct
 from prof_funct import Profile
 import profile_from
 import cross_calibrate
+import prof_bench
+import prof_instrument
+import prof_batch
+import prof_server
+import prof_watch
+import prof_catalog
+import prof_match
+import prof_pdd
+import prof_metrics
+import prof_lazy
+import prof_filter
+import prof_align
+import prof_kernels
+import prof_plane
 
 # pylint: disable = E1102, C0111
 
@@ -120,6 +135,32 @@ def test_magic_methods():
     assert np.isclose(sum(profiler.y), ref)
 
 
+def test_profile_arithmetic():
+    from prof_funct import MergedGrid
+    profiler = profile_from.tuples(PROFILER)
+    x, y = profiler.x.copy(), profiler.y.copy()
+    profiler - 2
+    profiler * 2
+    assert np.array_equal(profiler.x, x) and np.array_equal(profiler.y, y)  # UNCHANGED
+    planned = profile_from.beam(field_size=10, penumbra=0.5, increment=0.25)
+    measured = [planned.resample_x(0.4) * s for s in (1.0, 1.02)]
+    merged = MergedGrid(measured[0].x, planned.x)
+    assert np.all(np.isin(measured[0].x, merged.x))
+    assert merged.x[0] == -15 and merged.x[-1] == measured[0].x[-1]  # OVERLAP
+    ratios = [merged.ratio(m, planned) for m in measured]
+    assert np.allclose(ratios[1].y / ratios[0].y, 1.02)
+    assert np.allclose((measured[0] - planned).y, merged.difference(measured[0], planned).y)
+    assert np.allclose(merged.average(measured[0], planned, 1.0).y,
+                       measured[0].get_y(merged.x))
+    assert np.allclose((planned / planned).y, 1.0)
+    assert np.allclose((profiler + profiler).y, 2 * profiler.y)
+    try:
+        merged.ratio(planned, planned)
+        assert False
+    except ValueError:
+        pass
+
+
 def test_from_lists():
     empty = Profile()
     also_empty = profile_from.lists([], [])
@@ -137,6 +178,19 @@ def test_from_pulse():
     assert np.isclose(sum(pulse.y), 40)
 
 
+def test_from_beam():
+    beam = profile_from.beam(field_size=8, penumbra=0.6, increment=0.01, tail=0)
+    left = beam.x < 0
+    assert np.isclose(np.interp(0.8, beam.y[left], beam.x[left]) -
+                      np.interp(0.2, beam.y[left], beam.x[left]), 0.6)
+    assert np.allclose(beam.get_edges(), (-4, 4))
+    wedged = profile_from.beam(wedge=0.02, tail=0)
+    assert np.isclose(wedged.get_y(2) / wedged.get_y(0), 1.04)
+    noisy = profile_from.beam(noise=0.01, count=50, seed=0)
+    assert len(noisy) == 50 and not np.array_equal(noisy[0].y, noisy[1].y)
+    assert np.array_equal(noisy[7].y, profile_from.beam(noise=0.01, count=50, seed=0)[7].y)
+
+
 def test_from_snc_profiler():
     file_name = os.path.join(DATA_DIR, '2018_12_03 clinac 10x10 open.prs')
     x_profile = profile_from.snc_profiler(file_name, 'tvs')
@@ -150,6 +204,10 @@ def test_from_narrow_png():
     file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_vert_strip.png')
     png = profile_from.narrow_png(file_name)
     assert np.isclose(png.get_y(0), 0.609074819347117)
+    red, green, blue = profile_from.narrow_png(file_name, rgb=True)
+    assert np.array_equal(red.x, png.x)
+    assert np.isclose(np.average([red.get_y(0), green.get_y(0), blue.get_y(0)]),
+                      png.get_y(0))
 
 def test_from_raystation_line():
     file_name = os.path.join(DATA_DIR, '2018_02_08_raystation_line_dose.csv')
@@ -171,6 +229,20 @@ def test_from_pinnacle_ascii():
     assert len(pinn) == 5
     assert np.isclose(pinn[0].x[0], -24)
 
+def test_from_file():
+    file_name = os.path.join(DATA_DIR, '2018_12_03 clinac 10x10 open.prs')
+    tvs, rad = profile_from.from_file(file_name)
+    assert tvs == profile_from.snc_profiler(file_name, 'tvs')
+    assert rad == profile_from.snc_profiler(file_name, 'rad')
+    file_name = os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc')
+    assert len(profile_from.from_file(file_name)) == 2
+    try:
+        profile_from.from_file('profile.txt')
+        assert False
+    except ValueError:
+        pass
+
+
 def test_get_y():
     profiler = profile_from.tuples(PROFILER)
     assert np.isclose(profiler.get_y(0), 45.23)
@@ -278,6 +350,14 @@ def test_get_symmetry():
     assert np.isclose(symmetry, 0.024152376510553037)
 
 
+def test_get_gamma():
+    profiler = profile_from.tuples(PROFILER)
+    assert np.allclose(profiler.get_gamma(profiler).y, 0.0)
+    shifted = (profiler + 0.1).get_gamma(profiler, dose=0.03, dist=0.3)
+    assert np.all(shifted.y <= 1.0)
+    assert len(shifted) == len(profiler)
+
+
 def test_make_symmetric():
     profiler = profile_from.tuples(PROFILER)
     assert np.isclose(profiler.make_symmetric().get_symmetry(), 0.0)
@@ -298,6 +378,73 @@ def test_align_to():
     assert np.isclose(profiler.align_to(profiler+(2)).x[0], profiler.x[0] + 2)
 
 
+def test_align_coarse_to_fine():
+    film = profile_from.narrow_png(os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_vert_strip.png'))
+    beam = profile_from.beam(num_points=1001, noise=0.01, seed=0)
+    assert len(beam.get_pyramid()) == 4
+    assert beam.get_pyramid() is beam.get_pyramid()
+    for moving, fixed in [(film, (film + 1.5).make_flipped()),
+                          (beam.make_flipped() - 0.7, beam)]:
+        assert moving.align_to(fixed, coarse_to_fine=True) == moving.align_to(fixed)
+
+
+def test_align_many():
+    reference = profile_from.beam(num_points=601, wedge=0.02)
+    profiles = [reference + 1.3, (reference - 2.1).make_flipped(),
+                profile_from.beam(num_points=450, centre=-0.4, wedge=-0.02, domain=(-12, 14))]
+    aligned, offsets, flipped = prof_align.align_many(reference, profiles)
+    assert list(flipped) == [False, True, True]
+    for profile, result, offset in zip(profiles, aligned, offsets):
+        expected = profile.align_to(reference)
+        assert np.isclose(result.x[0], expected.x[0], atol=reference.get_increment())
+        assert np.isclose(result.x[0], profile.x[0] + offset)
+    profiler = profile_from.tuples(PROFILER)
+    assert np.allclose(prof_align.align_many(profiler+2, [profiler], workers=1)[1], 2)
+    assert np.isclose(prof_align.parabola(1.0, 2.0, 1.5), 1 / 6)  # VERTEX OF -0.75t^2 + 0.25t + 2
+    assert prof_align.parabola(1.0, 0.0, 1.0) == 0.0  # NOT A PEAK
+
+
+def test_kernels():
+    info = prof_kernels.diagnostics()
+    assert info['backend'] in ('numba', 'numpy')
+    assert info['kernels'] == sorted(prof_kernels.LOOPS)
+    beam = profile_from.beam(num_points=201, noise=0.01, seed=0)
+    x, y = np.array(beam.x, dtype=float), np.array(beam.y, dtype=float)
+    args = {'threshold_walk': [(y, 0.01), (y, 0.0)],
+            'crossings': [(x, y, 0.5), (x, y, y[50])],
+            'scan_offsets': [(x[::4], y[::4], x, y, np.linspace(-1, 1, 21))]}
+    for name, cases in args.items():
+        for case in cases:
+            expected = prof_kernels.NUMPY[name](*case)
+            for kernel in (prof_kernels.LOOPS[name], prof_kernels.KERNELS[name]):
+                result = kernel(*case)
+                assert len(result) == len(expected) and np.allclose(result, expected)
+
+
+def test_plane():
+    bx = profile_from.beam(field_size=8, wedge=0.03)
+    by = profile_from.beam(field_size=6, centre=1.0)
+    fx, fy = np.arange(-10, 10.01, 0.2), np.arange(-8, 8.01, 0.2)
+    fixed = prof_plane.Plane(fx, fy, np.outer(by.get_y(fy), bx.get_y(fx)))
+    mx, my = np.arange(-11, 11.01, 0.1), np.arange(-9, 9.01, 0.1)
+    mirrored = (mx[0] + mx[-1]) - mx
+    moving = prof_plane.Plane(mx, my, np.outer(by.get_y(my + 0.57), bx.get_y(mirrored - 1.23)))
+    aligned, transform = prof_plane.register(moving, fixed)
+    assert transform['flip_x'] and not transform['flip_y']
+    assert np.isclose(transform['dx'], -1.23, atol=0.05) and np.isclose(transform['dy'], 0.57, atol=0.05)
+    assert np.allclose(aligned.dose, fixed.dose, atol=0.03)
+    assert np.allclose(aligned.get_profile('x').y, fixed.get_profile('x').y, atol=0.03)
+
+    film = prof_plane.from_png(os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_horz_strip.png'))
+    strip = profile_from.narrow_png(os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_horz_strip.png'))
+    assert film.dose.shape[0] == 1 and abs(len(film.x) - len(strip)) <= 1
+
+    import tempfile
+    file_name = os.path.join(tempfile.mkdtemp(), 'plane.txt')
+    np.savetxt(file_name, np.vstack([np.append(0, fx), np.column_stack([fy, fixed.dose])]))
+    assert np.allclose(prof_plane.from_matrix(file_name).dose, fixed.dose)
+
+
 def test_cross_calibrate():
     reference_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib.prs')
     measured_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_vert_strip.png')
@@ -306,18 +453,419 @@ def test_cross_calibrate():
     ### in order for this to work, the PNG image must be a "negative if RGB"
 
 
+def test_cross_calibrate_rgb():
+    reference_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib.prs')
+    measured_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_vert_strip.png')
+    cal_curve = cross_calibrate.cross_calibrate_rgb(reference_file_name, measured_file_name)
+    red, green, blue = profile_from.narrow_png(measured_file_name, rgb=True)
+    assert np.isclose(cal_curve(red.get_y(0), green.get_y(0), blue.get_y(0)), 265, rtol=0.2)
+
+
+def test_cross_calibrate_batch():
+    reference_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib.prs')
+    measured_file_name = os.path.join(DATA_DIR, 'film', '2017_12_04 FilmCalib_EBT_vert_strip.png')
+    cal_curve, offsets = cross_calibrate.cross_calibrate_batch(
+        reference_file_name, [measured_file_name]*2, workers=2)
+    assert np.allclose(cal_curve([0.3, 0.5, 0.65]), [22, 135, 325], atol=10, rtol=0.2)
+    assert len(offsets) == 2
+    assert offsets[0] == offsets[1]
+    assert offsets[0][1]  # THE VERTICAL STRIP IS SCANNED UPSIDE DOWN
+
+
+def test_decimate():
+    import prof_gui
+    x = np.linspace(-15, 15, 100001)
+    y = np.sin(x) + np.random.default_rng(0).normal(0, 0.1, len(x))
+    y[12345], y[67890] = 5.0, -5.0
+    dx, dy = prof_gui._decimate(x, y, 200)
+    assert len(dx) <= 4 * 200 and np.all(np.diff(dx) > 0)
+    assert dx[0] == x[0] and dx[-1] == x[-1]
+    assert dy.max() == 5.0 and dy.min() == -5.0
+    dx, dy = prof_gui._decimate(x, y, 100, start=-5, stop=5)
+    assert dx[0] < -5 <= dx[1] and dx[-2] <= 5 < dx[-1]  # ONE POINT EITHER SIDE
+    visible = (x >= dx[0]) & (x <= dx[-1])
+    assert dy.max() == y[visible].max() and dy.min() == y[visible].min()
+    dx, dy = prof_gui._decimate(x[::-1], y[::-1], 200)  # DESCENDING, NOT TRIMMED
+    assert dx[0] == x[-1] and dx[-1] == x[0] and dy.max() == 5.0 and dy.min() == -5.0
+    short = prof_gui._decimate(x[:50], y[:50], 200)
+    assert np.array_equal(short[0], x[:50])
+    dx, dy = prof_gui._decimate(x, y, 100, start=x[1000], stop=x[1398])  # LAST BIN ONE POINT
+    assert dx[0] == x[999] and dx[-1] == x[1399] and np.all(np.diff(dx) > 0)
+    assert np.array_equal(dy, y[np.searchsorted(x, dx)])
+
+
+def test_bench_compare():
+    old = {'results': [{'name': 'Profile.get_y', 'source': 'synthetic',
+                        'points': 83, 'seconds': 1.0}]}
+    new = {'results': [{'name': 'Profile.get_y', 'source': 'synthetic',
+                        'points': 83, 'seconds': 1.5},
+                       {'name': 'Profile.get_x', 'source': 'synthetic',
+                        'points': 83, 'seconds': 1.0}]}
+    rows = prof_bench.compare(new, old, threshold=1.2)
+    assert len(rows) == 1
+    assert np.isclose(rows[0][5], 1.5)
+    assert rows[0][6]
+    benched = {method.partition(':')[0] for method, _, _ in prof_bench.METHODS}
+    public = {m for m in vars(Profile) if callable(getattr(Profile, m)) and not m.startswith('_')}
+    assert public - {'plot'} <= benched
+
+
+def test_instrument():
+    profiler = profile_from.tuples(PROFILER)
+    get_y = Profile.get_y
+    with prof_instrument.instrument(allocations=True) as stats:
+        profiler.get_y(0)
+        profiler.get_y(1)
+        profiler.make_centered()
+    assert Profile.get_y is get_y
+    assert stats.ops['Profile.get_y']['calls'] == 2
+    assert stats.ops['Profile.get_y']['points'] == 2 * len(PROFILER)
+    assert stats.ops['Profile.get_edges']['calls'] == 1
+    assert stats.ops['Profile.interp']['calls'] >= 2  # BUILT IN THE BLOCK
+    assert isinstance(vars(Profile)['interp'], property)
+    assert stats.ops['Profile.make_centered']['bytes'] > 0
+    assert 'Profile.get_y' in stats.table()
+    assert 'Profile.get_y' in stats.to_json()
+
+
+def test_batch():
+    file_name = os.path.join(DATA_DIR, '2018_12_03 clinac 10x10 open.prs')
+    analyses = ['edges', 'flatness', 'penumbra', 'gamma']
+    reference = profile_from.snc_profiler(file_name, 'rad')
+    rows = list(prof_batch.run([file_name], analyses, reference, workers=1))
+    assert len(rows) == 2
+    assert set(rows[1]) == set(prof_batch.fields(analyses))
+    assert np.isclose(rows[1]['gamma_pass'], 1.0)
+    assert np.isclose(rows[1]['flatness'], reference.get_flatness())
+    for row in rows + prof_batch.analyse_file(os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc'), ['penumbra']):
+        assert row['error'] is None
+        assert 0.2 < row['penumbra_left'] < 1.0 and 0.2 < row['penumbra_right'] < 1.0
+    assert prof_batch.expand([DATA_DIR]) == prof_batch.expand(
+        [os.path.join(DATA_DIR, '**', '*.*')])
+    missing = prof_batch.analyse_file('missing.asc', analyses)
+    assert missing[0]['error'].startswith('import')
+
+
+def test_server():
+    import json
+    import threading
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    server = prof_server.serve(port=0, workers=1, root=DATA_DIR)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    file_name = os.path.join(DATA_DIR, '2018_12_03 clinac 10x10 open.prs')
+    try:
+        query = urllib.parse.urlencode({'path': file_name, 'analyses': 'edges'})
+        for _ in range(2):
+            rows = json.loads(urllib.request.urlopen(base + '/analyse?' + query).read())
+        assert len(rows) == 2
+        assert np.isclose(rows[1]['edge_left'], -4.8)
+        with open(file_name, 'rb') as upload:
+            request = urllib.request.Request(
+                base + '/analyse?name=upload.prs&analyses=flatness', data=upload.read())
+        rows = json.loads(urllib.request.urlopen(request).read())
+        assert rows[1]['flatness'] > 0
+        try:
+            urllib.request.urlopen(base + '/analyse?path=' + __file__)
+            assert False
+        except urllib.error.HTTPError as error:
+            assert error.code == 403
+        for name, data in (('upload.xyz', b'0 1'), ('upload.asc', b'not a scan')):
+            try:
+                urllib.request.urlopen(urllib.request.Request(
+                    base + '/analyse?name=' + name, data=data))
+                assert False
+            except urllib.error.HTTPError as error:
+                assert error.code == 400
+        metrics = json.loads(urllib.request.urlopen(base + '/metrics').read())
+        assert metrics['completed'] == 3 and metrics['failed'] == 2
+        assert metrics['cache_hits'] == 1
+        assert metrics['queue_depth'] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.service.close()
+
+    with prof_funct.precision('float32'):
+        service = prof_server.Service(workers=2)
+    try:
+        assert service.pool.submit(_worker_precision).result() == np.float32
+        source = service.local(file_name) + (None,)
+        rows = [service.analyse(source, ['edges']) for _ in range(4)]
+        assert all(r == rows[0] for r in rows)
+        assert service.metrics()['cache_hits'] >= 2  # ONE MISS PER WORKER AT MOST
+    finally:
+        service.close()
+
+
+def _worker_precision():
+    return prof_funct._precision
+
+
+def test_watch():
+    import shutil
+    import tempfile
+    folder = tempfile.mkdtemp()
+    try:
+        store = os.path.join(folder, 'results.jsonl')
+        shutil.copy(os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc'),
+                    os.path.join(folder, 'rfa.asc'))
+        watcher = prof_watch.Watcher(folder, store, analyses=['edges'], settle=3600)
+        assert watcher.poll() == []  # NOT SETTLED
+        watcher.settle = 0
+        assert len(watcher.poll()) == 1
+        assert watcher.poll() == []
+        with open(store) as results:
+            assert len(results.readlines()) == 2
+        restarted = prof_watch.Watcher(folder, store, analyses=['edges'], settle=0)
+        assert restarted.poll() == []
+        with open(os.path.join(folder, 'rfa.asc'), 'a') as changed:
+            changed.write('\n')
+        assert len(restarted.poll()) == 1
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_catalog():
+    import shutil
+    import tempfile
+    folder = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(DATA_DIR, '2007_11_20 - Pinnacle ASCII 40x40.dat'), folder)
+        shutil.copy(os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc'), folder)
+        catalog = prof_catalog.Catalog(os.path.join(folder, 'catalog.db'))
+        assert catalog.add_folder(folder) == 7
+        assert catalog.add_folder(folder) == 0  # UNCHANGED
+        found = catalog.query(energy=4, field_size=40, depth=10, direction='inline')
+        assert len(found) == 1 and found[0].meta['source'] == 'pinnacle'
+        assert found[0].load() == profile_from.pinnacle_ascii(found[0].file)[3]
+        rfa = catalog.query(source='rfa', field_size=4, depth=1.2)
+        assert [(h.meta['direction'], h.meta['offset']) for h in rfa] == \
+            [('inline', 0.0), ('crossline', 0.0)]
+        assert catalog.query(energy=6) == []
+        assert catalog.skipped == {}
+
+        with open(os.path.join(folder, 'broken.asc'), 'w') as broken:
+            broken.write('not a scan\n')
+        assert catalog.add_folder(folder) == 0
+        assert list(catalog.skipped) == [os.path.join(os.path.abspath(folder), 'broken.asc')]
+
+        with open(os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc')) as rfa:
+            contents = rfa.read().replace('%SSD \t1000', '%SSD \tunknown')
+        with open(os.path.join(folder, 'no_ssd.asc'), 'w') as no_ssd:
+            no_ssd.write(contents)
+        assert catalog.add_folder(folder) == 2
+        no_ssd = catalog.query(file=os.path.join(os.path.abspath(folder), 'no_ssd.asc'))
+        assert [h.meta['ssd'] for h in no_ssd] == [None, None]
+        catalog.close()
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_match():
+    handle = prof_catalog.ProfileHandle
+    base = {'direction': 'crossline', 'energy': 6.0, 'field_x': 10.0, 'field_y': 10.0,
+            'ssd': 100.0, 'wedge': '', 'offset': 0.0}
+    planned = [handle(None, 'tps.dat', i, dict(base, depth=d))
+               for i, d in enumerate([1.5, 5.0, 10.0, 20.0])]
+    planned.append(handle(None, 'tps.dat', 4, dict(base, depth=10.0, direction='inline')))
+    measured = [handle(None, 'rfa.asc', i, dict(base, depth=d))
+                for i, d in enumerate([10.02, 1.5, 30.0])]
+    pairs, lone_measured, lone_planned = prof_match.match(measured, planned)
+    assert [(m.index, p.index) for m, p in pairs] == [(0, 2), (1, 0)]
+    assert [m.index for m in lone_measured] == [2]
+    assert [p.index for p in lone_planned] == [1, 3, 4]
+
+    measured = [handle(None, 'rfa.asc', 0, dict(base, depth=10.3)),
+                handle(None, 'rfa.asc', 1, dict(base, depth=5.0, ssd=100.4)),
+                handle(None, 'rfa.asc', 2, dict(base, depth=5.0, wedge='60'))]
+    pairs, lone_measured, _ = prof_match.match(measured, planned)
+    assert [(m.index, p.index) for m, p in pairs] == [(1, 1)]
+    pairs, lone_measured, _ = prof_match.match(measured, planned, tol={'depth': 0.5})
+    assert [(m.index, p.index) for m, p in pairs] == [(0, 2), (1, 1)]
+    assert [m.index for m in lone_measured] == [2]  # WEDGE DIFFERS
+
+    measured = [handle(None, 'rfa.asc', i, dict(base, depth=5.0)) for i in range(2)]
+    pairs, _, lone_planned = prof_match.match(measured, planned)
+    assert [(m.index, p.index) for m, p in pairs] == [(0, 1), (1, 1)]  # MANY-TO-ONE
+    assert [p.index for p in lone_planned] == [0, 2, 3, 4]
+
+
+def test_pdd():
+    mu = 0.05
+
+    def pdd(depths):
+        dose = np.where(depths < 1.5, 50 + 50 * depths / 1.5,
+                        100 * np.exp(-mu * (depths - 1.5)))
+        return Profile(depths, dose)
+
+    curves = [pdd(np.linspace(0, 30, 301)), pdd(np.linspace(15, 0, 151)),
+              pdd(np.linspace(0, 5, 51))]
+    result = prof_pdd.metrics(curves)
+    assert np.allclose(result['dmax'], 1.5)
+    assert np.allclose(result['surface'], 50)
+    assert np.allclose(result['r50'][:1], 1.5 + np.log(2) / mu, atol=0.01)
+    assert np.allclose(result['r80'][:2], 1.5 + np.log(1.25) / mu, atol=0.01)
+    assert np.allclose(result['d10'][:2], 100 * np.exp(-mu * 8.5), atol=0.05)
+    assert np.isnan(result['r50'][1]) and np.isnan(result['d20'][1])
+    assert np.isnan(result['d10'][2])
+
+    import tempfile
+    depth = np.linspace(0, 30, 301)
+    scan = ['%DAT \t02-01-2018', '%TIM \t11:13:39', '%FSZ \t100\t100', '%SSD \t1000',
+            '%WEG \t0', '%PTS \t301', '%STS \t 0.0\t 0.0\t 0.0 # Start',
+            '%EDS \t 0.0\t 0.0\t 300.0 # End']
+    scan += ['= \t 0.0 0.0 {:.1f} {:.4f}'.format(10 * d, y) for d, y in zip(depth, pdd(depth).y)]
+    file_name = os.path.join(tempfile.mkdtemp(), 'pdd.asc')
+    with open(file_name, 'w') as rfa_file:
+        rfa_file.write(':MSR \t1\n' + '\n'.join(scan) + '\n:EOM # 1\n')
+    imported = profile_from.rfa_ascii(file_name)
+    assert imported[0].x[0] < 0  # CENTRED BY THE IMPORTER
+    result = prof_pdd.metrics(imported)
+    assert np.allclose(result['dmax'], 1.5)
+    assert np.allclose(result['r50'], 1.5 + np.log(2) / mu, atol=0.01)
+
+
+def test_metrics():
+    file_name = os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc')
+    profiles = profile_from.rfa_ascii(file_name)
+    result = prof_metrics.metrics(profiles, flatness=['range', 'varian', 'iec'],
+                                  symmetry=['point_difference', 'point_ratio', 'area'],
+                                  regions=[0.8, 0.9])
+    assert len(result) == 2
+    for profile, row in zip(profiles, result):
+        assert np.isclose(row['flatness_range_80'], profile.get_flatness())
+        assert np.isclose(row['symmetry_point_difference_80'], profile.get_symmetry())
+        assert row['flatness_iec_90'] >= row['flatness_iec_80'] >= 1
+    flat = Profile(np.linspace(-10, 10, 201), np.where(np.abs(np.linspace(-10, 10, 201)) < 5, 1.0, 0.0))
+    row = prof_metrics.metrics(flat, symmetry=['area'])[0]
+    assert row['flatness_range_80'] == 0 and abs(row['symmetry_area_80']) < 1e-12
+
+
+def test_lazy():
+    import copy
+    file_name = os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc')
+    profile = profile_from.rfa_ascii(file_name)[0]
+    chains = [
+        lambda p: p.make_centered().make_normal_y().resample_x(0.1).slice_segment(-5, 5),
+        lambda p: (p + 0.3).make_flipped().slice_segment(-4, 6).resample_x(0.05),
+        lambda p: (p * 2.0 - 0.1).resample_x(0.2).make_centered().make_normal_y(1.0, 2.0)]
+    for chain in chains:
+        source = copy.deepcopy(profile)
+        deferred = chain(prof_lazy.lazy(source))
+        assert source == profile  # NOT YET APPLIED, NOR MUTATED
+        assert deferred.compute() == chain(copy.deepcopy(profile))
+    with prof_funct.precision('float32'):
+        single = profile_from.rfa_ascii(file_name)[0]
+        for chain in chains:
+            result, eager = chain(prof_lazy.lazy(single)).compute(), chain(single)
+            assert result.x.dtype == result.y.dtype == np.float32  # CAST ONCE, FUSED
+            assert np.allclose(result.x, eager.x, atol=1e-4)
+            assert np.allclose(result.y, eager.y, rtol=1e-5, atol=1e-3)
+    stored = Profile(profile.x.astype(np.float32), profile.y.astype(np.float32))
+    assert chains[0](prof_lazy.lazy(stored)).compute().y.dtype == np.float32
+
+
+def test_uniform_grid():
+    from scipy import interpolate
+    profiler = profile_from.tuples(PROFILER)
+    assert profiler.grid is not None and np.isclose(profiler.grid[1], 0.4)
+    assert Profile(x=[0, 1, 3], y=[0, 1, 2]).grid is None
+    general = interpolate.interp1d(profiler.x, profiler.y,
+                                   bounds_error=False, fill_value=0.0)
+    points = np.concatenate((profiler.x, np.linspace(-20, 20, 1001)))
+    assert np.array_equal(profiler.get_y(points), general(points))
+    for start, stop in [(-5, 5), (-0.4, -0.4), (-30, -20), (3, 1), (-np.inf, np.inf)]:
+        keep = (profiler.x >= start) & (profiler.x <= stop)
+        assert np.array_equal(profiler.slice_segment(start, stop).x, profiler.x[keep])
+
+
+def _beam(num_points, domain=(-15.0, 15.0)):
+    """ 10 cm field, 0.36 cm penumbra, flat 2% tails """
+    return profile_from.beam(field_size=10.0, penumbra=0.36, domain=domain,
+                             num_points=num_points, tail_length=np.inf)
+
+
+def test_precision():
+    file_name = os.path.join(DATA_DIR, '2018_02_01 RFA300 ASCII Measurement.asc')
+    double = profile_from.rfa_ascii(file_name)[0]
+    with prof_funct.precision('float32'):
+        single = profile_from.rfa_ascii(file_name)[0]
+        resampled = single.make_normal_y().resample_x(0.1).slice_segment(-5, 5)
+        assert resampled.x.dtype == resampled.y.dtype == np.float32
+        assert prof_pdd.stack([single, single])[1].dtype == np.float32
+    assert single.y.dtype == np.float32 and double.y.dtype == np.float64
+    assert Profile(x=[0, 1], y=[0, 1]).y.dtype != np.float32
+    assert np.allclose(single.get_edges(), double.get_edges())
+    beam = _beam(1001)
+    tilted = (beam.x, beam.y * (1 + 0.01 * beam.x))
+    with prof_funct.precision(np.float32):
+        single = Profile(*tilted)
+    assert np.isclose(single.get_flatness(), Profile(*tilted).get_flatness(), rtol=1e-4)
+
+
+def test_interp_kinds():
+    sparse = _beam(76)  # 0.4 cm PITCH
+    fine = np.linspace(-6, -4, 201)  # PENUMBRA
+    exact = _beam(201, domain=(-6, -4)).y
+    linear_error = np.abs(sparse.get_y(fine) - exact).max()
+    for kind in ('pchip', 'cubic'):
+        smooth = sparse.make_interp(kind)
+        assert smooth.interp is smooth.interp  # CACHED
+        assert np.abs(smooth.get_y(fine) - exact).max() < 0.6 * linear_error
+        assert smooth.get_y(100.0) == 0.0
+        assert smooth.resample_x(0.1).kind == kind
+        assert smooth.resample_y(1.0).kind == kind
+        assert smooth.make_normal_x().kind == kind
+        assert smooth.slice_umbra().kind == kind
+        assert smooth.make_symmetric().kind == kind
+        assert (smooth + 1.0).kind == kind
+    shifted = sparse.make_interp() + 0.8
+    assert np.isclose(shifted.align_to(sparse).x[0], sparse.x[0], atol=0.4)
+    try:
+        Profile(x=[0, 1], y=[0, 1], kind='quintic')
+        assert False
+    except ValueError:
+        pass
+
+
+def test_filter():
+    beam = _beam(601)  # 0.05 cm PITCH
+    noise = np.random.default_rng(0).normal(0, 0.02, (4, len(beam)))
+    noisy = [Profile(beam.x, beam.y + n) for n in noise]
+    for func in (prof_filter.savgol, prof_filter.median, prof_filter.gaussian):
+        smooth = func(noisy)
+        assert len(smooth) == 4 and np.array_equal(smooth[0].x, beam.x)
+        assert np.std(smooth[0].y - beam.y) < 0.6 * np.std(noise[0])
+        assert np.allclose(func(noisy[2]).y, smooth[2].y)  # BATCH AS SINGLE
+    x = np.sort(np.random.default_rng(1).uniform(-15, 15, 400))
+    irregular = Profile(x, beam.get_y(x))
+    smooth = prof_filter.gaussian(irregular, 0.2)
+    assert smooth.grid is None and np.array_equal(smooth.x, irregular.x)
+    assert np.allclose(smooth.get_edges(), (-5, 5), atol=0.2)
+    flat = Profile(np.append(np.arange(0, 0.86, 0.05), 0.99), np.ones(19))
+    for func, width in ((prof_filter.gaussian, 0.1), (prof_filter.median, 0.3),
+                        (prof_filter.savgol, 0.3)):
+        assert np.allclose(func(flat, width).y, 1.0)
+
+
 if __name__ == "__main__":
     test_init()
     test_interp()
     test_magic_methods()
+    test_profile_arithmetic()
     test_from_lists()
     test_fromtuples()
     test_from_pulse()
+    test_from_beam()
     test_from_snc_profiler()
     test_from_narrow_png()
     test_from_raystation_line()
     test_from_rfa_ascii()
     test_from_pinnacle_ascii()
+    test_from_file()
     test_get_y()
     test_get_x()
     test_get_increment()
@@ -333,8 +881,30 @@ if __name__ == "__main__":
     test_slice_tails()
     test_get_flatness()
     test_get_symmetry()
+    test_get_gamma()
     test_make_symmetric()
     test_make_centered()
     test_make_flipped()
     test_align_to()
+    test_align_coarse_to_fine()
+    test_align_many()
+    test_kernels()
+    test_plane()
     test_cross_calibrate()
+    test_cross_calibrate_rgb()
+    test_cross_calibrate_batch()
+    test_decimate()
+    test_bench_compare()
+    test_instrument()
+    test_batch()
+    test_server()
+    test_watch()
+    test_catalog()
+    test_match()
+    test_pdd()
+    test_metrics()
+    test_lazy()
+    test_uniform_grid()
+    test_precision()
+    test_interp_kinds()
+    test_filter()
@@ -0,0 +1,183 @@
+# Copyright (C) 2019 Paul King
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version (the "AGPL-3.0+").
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License and the additional terms for more
+# details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# ADDITIONAL TERMS are also included as allowed by Section 7 of the GNU
+# Affero General Public License. These additional terms are Sections 1, 5,
+# 6, 7, 8, and 9 from the Apache License, Version 2.0 (the "Apache-2.0")
+# where all references to the definition "License" are instead defined to
+# mean the AGPL-3.0+.
+
+# You should have received a copy of the Apache-2.0 along with this
+# program. If not, see <http://www.apache.org/licenses/LICENSE-2.0>.
+
+""" Watch a folder and analyse new or changed measurement files.
+
+    Usage
+    -----
+    ``python prof_watch.py /shared/scans --store qa.jsonl``
+    ``python prof_watch.py /shared/scans --store qa.jsonl --once``
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import profile_from
+import prof_batch
+
+# pylint: disable = C0103, C0121, W0102
+
+
+class Watcher():
+    """ incremental processing of a folder, by polling
+
+    A file is processed once its modification time is at least settle
+    seconds old, so files still being written are left for a later poll.
+    Processed files are recorded with their mtime and size in a manifest,
+    which is saved after each file, so a restart only picks up files
+    that are new or changed since.
+
+    Attributes
+    ----------
+    folder : str
+    store : str
+        JSON-lines file that result rows are appended to
+    manifest_file : str
+    manifest : dict
+        {path: [mtime_ns, size]}
+    analyses : list of str
+    reference : Profile
+    settle : float
+
+    """
+
+    def __init__(self, folder, store, manifest_file=None,
+                 analyses=prof_batch.DEFAULT_ANALYSES, reference=None,
+                 settle=2.0):
+        self.folder = folder
+        self.store = store
+        self.manifest_file = manifest_file or store + '.manifest.json'
+        self.analyses = list(analyses)
+        self.reference = reference
+        self.settle = settle
+        try:
+            with open(self.manifest_file) as manifest:
+                self.manifest = json.load(manifest)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def _save_manifest(self):
+        temp_name = self.manifest_file + '.tmp'
+        with open(temp_name, 'w') as manifest:
+            json.dump(self.manifest, manifest)
+        os.replace(temp_name, self.manifest_file)  # ATOMIC
+
+    def scan(self, now=None):
+        """ files that are new or changed and have settled
+
+        Returns
+        -------
+        list of (path, [mtime_ns, size])
+
+        """
+        now = time.time() if now is None else now
+        ready = []
+        for file_name in prof_batch.expand([self.folder]):
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:  # REMOVED SINCE LISTED
+                continue
+            stamp = [stat.st_mtime_ns, stat.st_size]
+            if self.manifest.get(file_name) == stamp:
+                continue
+            if now - stat.st_mtime_ns / 1e9 < self.settle:
+                continue
+            ready.append((file_name, stamp))
+        return ready
+
+    def process(self, file_name, stamp):
+        """ analyse one file, append its rows, record it """
+        rows = prof_batch.analyse_file(file_name, self.analyses, self.reference)
+        with open(self.store, 'a') as store:
+            for row in rows:
+                store.write(json.dumps(row) + '\n')
+        self.manifest[file_name] = stamp
+        self._save_manifest()
+        return rows
+
+    def poll(self):
+        """ process everything ready now
+
+        Returns
+        -------
+        list of str
+            files processed
+
+        """
+        done = []
+        for file_name, stamp in self.scan():
+            self.process(file_name, stamp)
+            done.append(file_name)
+        return done
+
+    def run(self, interval=5.0):
+        """ poll forever """
+        while True:
+            self.poll()
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder')
+    parser.add_argument('--store', required=True,
+                        help='JSON-lines file to append results to')
+    parser.add_argument('--manifest', help='default: STORE.manifest.json')
+    parser.add_argument('--analyses', nargs='+', choices=list(prof_batch.ANALYSES),
+                        default=prof_batch.DEFAULT_ANALYSES)
+    parser.add_argument('--reference', help='reference file, for gamma')
+    parser.add_argument('--reference-index', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='seconds between polls')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='seconds since last write before processing')
+    parser.add_argument('--once', action='store_true',
+                        help='process what is ready and exit')
+    args = parser.parse_args(argv)
+
+    analyses = list(args.analyses)
+    reference = None
+    if args.reference:
+        reference = profile_from.from_file(args.reference)[args.reference_index]
+        if 'gamma' not in analyses:
+            analyses.append('gamma')
+
+    watcher = Watcher(args.folder, args.store, args.manifest, analyses,
+                      reference, args.settle)
+    if args.once:
+        watcher.poll()
+        return 0
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,7 +31,7 @@ import copy
 import sys
 
 from typing import Callable
-from scipy import interpolate
+from scipy import interpolate, special
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -122,16 +122,69 @@ def pulse(centre, width, domain, increment, meta={}):
 
     """
     x_vals = np.arange(domain[0], domain[1] + increment, increment)
-    y = []
-    for x in x_vals:
-        if abs(x) > (centre + width/2.0):
-            y.append(0.0)
-        elif abs(x) < (centre + width/2.0):
-            y.append(1.0)
-        else:
-            y.append(0.5)
+    edge = centre + width/2.0
+    y = np.where(np.abs(x_vals) > edge, 0.0,
+                 np.where(np.abs(x_vals) < edge, 1.0, 0.5))
     return lists(x_vals, y, meta=meta)
 
+def beam(field_size=10.0, penumbra=0.5, domain=(-15.0, 15.0), increment=0.1,
+         num_points=None, centre=0.0, wedge=0.0, tail=0.02, tail_length=5.0,
+         noise=0.0, count=None, seed=None, meta={}):
+    """ create synthetic beam profile, of unit height
+
+    Error-function edges, with an optional wedge slope, exponential
+    tails outside the field and gaussian noise. All points, and all
+    profiles when a count is given, are computed as single arrays.
+
+    Parameters
+    ----------
+    field_size : float, optional
+        distance between 50% points, cm
+    penumbra : float, optional
+        distance from 20% to 80%, cm
+    domain : tuple, optional
+        (x_left, x_right)
+    increment : float, optional
+        ignored if num_points is given
+    num_points : int, optional
+    centre : float, optional
+    wedge : float, optional
+        fractional change in dose per cm, across the field
+    tail : float, optional
+        dose at the field edge due to the tails, fraction of the centre
+    tail_length : float, optional
+        distance over which the tails fall by a factor e, cm
+    noise : float, optional
+        standard deviation, fraction of the centre
+    count : int, optional
+        number of profiles, differing only in their noise
+    seed : int, optional
+        for the noise
+    meta : dict, optional
+
+    Returns
+    -------
+    Profile, or list of Profile if count is given
+
+    """
+    if num_points is None:
+        num_points = int(round((domain[1] - domain[0]) / increment)) + 1
+    x = np.linspace(domain[0], domain[1], num_points)
+    sigma = penumbra / (2 * special.erfinv(0.6))  # 20% TO 80%
+    dist = x - centre
+    y = 0.5 * (special.erf((dist + field_size/2) / sigma) -
+               special.erf((dist - field_size/2) / sigma))
+    y *= 1 + wedge * dist
+    outside = np.maximum(np.abs(dist) - field_size/2, 0.0)
+    y = (1 - tail) * y + tail * np.exp(-outside / tail_length)
+
+    rows = 1 if count is None else count
+    y = np.broadcast_to(y, (rows, num_points))
+    if noise:
+        y = y + np.random.default_rng(seed).normal(0.0, noise, y.shape)
+    profiles = [Profile(x=x, y=row, meta=meta) for row in y]
+    return profiles[0] if count is None else profiles
+
 def snc_profiler(file_name, axis):
     """ import profile form SNC Profiler file
 
@@ -188,7 +241,7 @@ def snc_profiler(file_name, axis):
     else:
         raise TypeError("axis must be 'tvs' or 'rad'")
 
-def narrow_png(file_name, step_size=0.1):
+def narrow_png(file_name, step_size=0.1, rgb=False):
     """ import from png file
 
     Source file is a full color PNG, sufficiently narrow that
@@ -199,15 +252,20 @@ def narrow_png(file_name, step_size=0.1):
     ----------
     file_name : str
     step-size : float, optional
+    rgb : bool, optional
+        keep the red, green and blue channels separate
 
     Returns
     -------
     Profile
+        or tuple of (red, green, blue) Profiles, if rgb
 
     Raises
     ------
     ValueError
         if aspect ratio <= 5, i.e. not narrow
+    ValueError
+        if rgb and the image has fewer than 3 channels
     AssertionError
         if step_size <= 12.7 over dpi, i.e. small
 
@@ -218,13 +276,17 @@ def narrow_png(file_name, step_size=0.1):
     dpi_horiz, dpi_vert = image_file.info['dpi']
 
     image_array = mpimg.imread(file_name)
+    if rgb:
+        if image_array.ndim != 3 or image_array.shape[2] < 3:
+            raise ValueError('The PNG file has no RGB channels.')
+        image_array = image_array[:, :, :3]  # DISCARD ALPHA
 
     # DIMENSIONS TO AVG ACROSS DIFFERENT FOR HORIZ VS VERT IMG
     if image_array.shape[0] > 5*image_array.shape[1]:    # VERT
-        image_vector = np.average(image_array, axis=(1, 2))
+        image_vector = np.mean(image_array, axis=1 if rgb else (1, 2), dtype=float)
         pixel_size_in_cm = (2.54 / dpi_vert)
     elif image_array.shape[1] > 5*image_array.shape[0]:  # HORIZ
-        image_vector = np.average(image_array, axis=(0, 2))
+        image_vector = np.mean(image_array, axis=0 if rgb else (0, 2), dtype=float)
         pixel_size_in_cm = (2.54 / dpi_horiz)
     else:
         raise ValueError('The PNG file is not a narrow strip.')
@@ -243,17 +305,21 @@ def narrow_png(file_name, step_size=0.1):
     sample_indices = np.arange(num_pixels_to_avg_over/2,
                                 len(full_resolution_distances),
                                 num_pixels_to_avg_over).astype(int)
-    downsampled_distances = list(full_resolution_distances[sample_indices])
+    downsampled_distances = full_resolution_distances[sample_indices]
 
-    downsampled_density = []
-    for idx in sample_indices:  # AVERAGE OVER THE SAMPLING WINDOW
-        avg_density = np.average(
-            image_vector[int(idx - num_pixels_to_avg_over / 2):
-                            int(idx + num_pixels_to_avg_over / 2)])
-        downsampled_density.append(avg_density)
+    # AVERAGE OVER THE SAMPLING WINDOW, ALL WINDOWS AND CHANNELS AT ONCE
+    lo = (sample_indices - num_pixels_to_avg_over / 2).astype(int)
+    hi = np.minimum((sample_indices + num_pixels_to_avg_over / 2).astype(int),
+                    image_vector.shape[0])
+    running_sum = np.cumsum(image_vector, axis=0, dtype=float)
+    running_sum = np.concatenate((np.zeros((1,) + image_vector.shape[1:]),
+                                  running_sum))
+    downsampled_density = ((running_sum[hi] - running_sum[lo]).T / (hi - lo)).T
 
-    zipped_profile = list(zip(downsampled_distances, downsampled_density))
-    return tuples(zipped_profile)
+    if rgb:
+        return tuple(Profile(x=downsampled_distances, y=channel)
+                     for channel in downsampled_density.T)
+    return Profile(x=downsampled_distances, y=downsampled_density)
 
 
 def raystation_line(file_name):
@@ -321,13 +387,17 @@ def rfa_ascii(file_name):
             regex = key[0] + r'\W+(.{1,})\n'
             meta[key[1]] = re.search(regex, measurement).group(1)
 
+        beam = re.search(r'%BMT\W+(\w+)\s+(.+)\n', measurement)
+        if beam:
+            meta['beam'] = (beam.group(1), beam.group(2).strip())
+
         key = (r'%FSZ', 'field_size')
         regex = key[0] + r'\W+(.+)\t(.+)\n'
         meta[key[1]] = (re.search(regex, measurement).group(1), 
                         re.search(regex, measurement).group(2))
 
         for key in (('%STS', 'start_pt'), (r'%EDS', 'end_pt')):
-            regex = key[0] + r'\W+(.+)\t(.+)\t(.+) #'
+            regex = key[0] + r'\s+(.+)\t(.+)\t(.+) #'  # KEEPS A LEADING MINUS
             meta[key[1]] = (re.search(regex, measurement).group(1).strip(),
                             re.search(regex, measurement).group(2).strip(),
                             re.search(regex, measurement).group(3).strip())
@@ -394,4 +464,38 @@ def pinnacle_ascii(file_name):
         y = data[:,1]
         result.append(Profile(x=x, y=y, meta=meta))
 
-    return result
\ No newline at end of file
+    return result
+
+def from_file(file_name):
+    """ import all profiles from a file, by extension
+
+    .prs SNC Profiler (tvs, rad), .png film, .csv RayStation line,
+    .asc RFA, .dat Pinnacle.
+
+    Parameters
+    ----------
+    file_name : str
+
+    Returns
+    -------
+    list of Profile
+
+    Raises
+    ------
+    ValueError
+        if the extension is not recognised
+
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.prs':
+        return [snc_profiler(file_name, 'tvs'), snc_profiler(file_name, 'rad')]
+    elif extension == '.png':
+        return [narrow_png(file_name)]
+    elif extension == '.csv':
+        return [raystation_line(file_name)]
+    elif extension == '.asc':
+        return rfa_ascii(file_name)
+    elif extension == '.dat':
+        return pinnacle_ascii(file_name)
+    else:
+        raise ValueError('unrecognised file type: ' + file_name)